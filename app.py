@@ -1,222 +1,388 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Request, render_template, request, jsonify, Response, stream_with_context, g
+from werkzeug.exceptions import RequestEntityTooLarge
 import json
-from datetime import datetime
+import logging
+import math
+import time
+from datetime import datetime, timedelta
 import os
-import tempfile
 from dotenv import load_dotenv
-import anthropic
 
+# Modules below read their settings at import time, so .env has to be loaded first
 load_dotenv()
 
+from document_store import DocumentStore, UnknownDocumentError, hash_content
+from chunking import content_defined_chunks
+from storage import build_storage
+from question_bank import build_question_bank, SECTION_PROMPT, MAX_CHUNK_ATTEMPTS, number_sections, questions_by_section
+from prompts import study_request, PROMPT_CACHE_MAX_TOKENS
+from routing import ROUTES, route, complete, escalate
+from speech import build_speech_streams, SpeechError, SpeechUnavailableError, DEFAULT_SAMPLE_RATE
+from http_cache import StaticPages, compress_response, conditional_response, parse_timestamp
+from metrics import (
+    registry, stage, http_requests, http_latency, start_sampled_profile, finish_sampled_profile,
+    profiled, profiled_iter
+)
+from llm_client import llm_provider
+from response_cache import build_response_cache, make_cache_key, SingleFlight, MemoryCacheBackend
+from llm_executor import build_llm_executor, ExecutorBusyError, LLMTimeoutError
+from prefetch import build_followup_prefetcher, build_coverage_prefetcher
+from ingestion import BoundedUploadFile, extract_text, UploadError
+from retrieval import BM25Index, select_passages, estimate_tokens, term_frequencies, CHARS_PER_TOKEN
+from grading import (
+    GRADING_INSTRUCTIONS, build_grading_prompt, parse_grading_response,
+    partial_score, partial_string_field, local_grade_answer,
+    build_batch_grading_prompt, parse_batch_grading_response
+)
+
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+logger = logging.getLogger("studyai")
+
+
+class UploadRequest(Request):
+    """Request whose uploaded files go straight to temp files that enforce MAX_UPLOAD_BYTES while received"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_files = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        upload = BoundedUploadFile(MAX_UPLOAD_BYTES, too_large=RequestEntityTooLarge)
+        self.upload_files.append(upload)
+        return upload
+
+
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config["SECRET_KEY"] = "studyai-secret-key"
 
-# In-memory storage for demo (replace with database in production)
-study_sessions = []
-uploaded_files = []
+# Templates without per-request context are rendered once and served pre-compressed
+static_pages = StaticPages(render_template, os.path.join(app.root_path, app.template_folder))
+storage = build_storage()
+document_store = DocumentStore()
+question_bank = build_question_bank()
+speech_streams = build_speech_streams()
 
-important_things = []
-Official_Questions = []
-Official_Answers = []
-Official_Dictionary = {}
+# Uploads above MAX_UPLOAD_BYTES are rejected while being received; above INGEST_ASYNC_BYTES they are
+# extracted in the background
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+INGEST_ASYNC_BYTES = int(os.getenv("INGEST_ASYNC_BYTES", str(2 * 1024 * 1024)))
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_REQUEST_BYTES", str(100 * 1024 * 1024)))
+response_cache = build_response_cache()
+llm_executor = build_llm_executor()
+# Concurrent identical LLM requests (same cache key) share one call
+llm_flights = SingleFlight(timeout=llm_executor.default_timeout)
+QUESTIONS_PER_SET = 5
+followup_prefetcher = build_followup_prefetcher(llm_executor)
+coverage_prefetcher = build_coverage_prefetcher(llm_executor)
 
-def anthro_key():
-    ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 
-    if ANTHROPIC_API_KEY:
-        try:
-            llm_client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-            llm_available = True
-            important_things.append(llm_client)
-            important_things.append(llm_available)
-            print("🤖 AI Integration: ENABLED (Anthropic Claude AI)")
-        except Exception as e:
-            print(f"⚠️ LLM not available: {e}")
-            print("⚠️ LLM Integration: DISABLED (Fallback mode)")
-    else:
-        print("⚠️ ANTHROPIC_API_KEY not found. LLM Integration: DISABLED (Fallback mode)")
-    
-    return ANTHROPIC_API_KEY
+# Grading and follow-up prompts only carry the passages relevant to the question
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "2000"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "8"))
+retrieval_indexes = MemoryCacheBackend(max_entries=64, ttl=0)
 
 
-def read_file_content(file_path):
-    """Read file content with proper encoding handling"""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return file.read()
-    except UnicodeDecodeError:
-        try:
-            with open(file_path, 'r', encoding='latin-1') as file:
-                return file.read()
-        except Exception as e:
-            return f"Error reading file: {e}"
-    except Exception as e:
-        return f"Error reading file: {e}"
+def current_user_id(data=None):
+    """Identify the student from the request body or the X-User-Id header"""
+    return (data or {}).get('user_id') or request.headers.get('X-User-Id') or 'anonymous'
 
-def generate_questions_with_ai(content):
-    """Generate questions using Anthropic API or fallback"""
+def ingest_upload(upload, filename, user_id):
+    """Extract, store and index one spooled upload; the temp file is always removed"""
     try:
-        prompt = "Based on the following study material, generate exactly 5 thoughtful questions and answers that test understanding and application. IMPORTANT: Return ONLY valid JSON, Format: an array of objects, each with \"Question\" and \"Answer\" keys, No explanations, no prefixes, no markdown, no text outside the JSON."
+        with stage("upload_parse"):
+            content = extract_text(upload, filename)
+        if not content:
+            raise UploadError("No text could be extracted from this file")
+        
+        # Store content once by hash and keep only metadata around
+        with stage("upload_store"):
+            file_data = document_store.put(content, filename)
+            get_retrieval_index(file_data['id'])
+            storage.record_upload(user_id, file_data)
+        return file_data
+    finally:
+        upload.cleanup()
 
-        key = anthro_key()
-        llm_client = important_things[0]
-        llm_available = important_things[1]
+def build_retrieval_index(doc_id):
+    """Build and persist a document's BM25 index over its chunks, tokenizing only chunks not seen before"""
+    chunks = document_store.get_chunks(doc_id)
+    if chunks is None:
+        raise UnknownDocumentError(f"Unknown document: {doc_id}")
+    passages = []
+    term_freqs = []
+    for chunk_hash, chunk in chunks:
+        if not chunk.strip():
+            continue
+        terms = document_store.get_chunk_sidecar(chunk_hash, "terms")
+        if terms is None:
+            terms = term_frequencies(chunk)
+            document_store.put_chunk_sidecar(chunk_hash, "terms", terms)
+        passages.append(chunk.strip())
+        term_freqs.append(terms)
+    index = BM25Index.build(passages, term_freqs)
+    document_store.put_sidecar(doc_id, "index", index.to_dict())
+    retrieval_indexes.set(doc_id, index)
+    return index
 
-        if llm_available and llm_client:
-            message = llm_client.messages.create(
-                model="claude-opus-4-1-20250805",
-                max_tokens=1024,
-                messages=[{"role": "user", "content": prompt+content}]
-            )
-            # Get raw text response
-            output = message.content[0].text.strip()
-            print(f"LLM Response: {output}")
-            
-            # Parse the JSON array
-            questions_data = json.loads(output)
-
-            # Extract only the "Question" fields
-            questions_only = [item["Question"] for item in questions_data]
-            answers_only = [item["Answer"] for item in questions_data]
-            Official_Questions.append(questions_only)
-            Official_Answers.append(answers_only)
-            Official_Dictionary.update(dict(zip(questions_only, answers_only)))
-
-            return questions_only
-            #answers_only = [item["Answers"] for item in questions_data]
-
-    #         # Try to parse as JSON array
-    #         try:
-    #             questions = json.loads(output)
-    #             if isinstance(questions, list) and len(questions) >= 5:
-    #                 return questions[:5]
-    #         except json.JSONDecodeError:
-    #             pass
-            
-    #         # Fallback: try to extract questions from text
-    #         lines = [line.strip() for line in output.split('\n') if line.strip()]
-    #         questions = []
-    #         for line in lines:
-    #             if line.startswith('"') and line.endswith('"'):
-    #                 questions.append(line[1:-1])
-    #             elif '?' in line and len(line) > 10:
-    #                 questions.append(line)
-    #         return questions[:5] if questions else None
-    #     else:
-    #         return None
+def get_retrieval_index(doc_id):
+    index = retrieval_indexes.get(doc_id)
+    if index is not None:
+        return index
+    data = document_store.get_sidecar(doc_id, "index")
+    if data is not None:
+        index = BM25Index.from_dict(data)
+        retrieval_indexes.set(doc_id, index)
+        return index
+    return build_retrieval_index(doc_id)
+
+def resolve_study_content(data, query=None):
+    """Assemble study material from document IDs, falling back to inline content.
+
+    With a query, only the most relevant passages within RETRIEVAL_TOKEN_BUDGET are returned, unless the
+    whole material fits in PROMPT_CACHE_MAX_TOKENS: then it is sent whole so every call in the session
+    shares the same cacheable prefix.
+    """
+    document_ids = data.get('document_ids') or []
+    if query is None:
+        if document_ids:
+            return document_store.assemble(document_ids)
+        return data.get('content', '')
+
+    full_content_budget = max(RETRIEVAL_TOKEN_BUDGET, PROMPT_CACHE_MAX_TOKENS)
+    with stage("prompt_build"):
+        if document_ids:
+            total_chars = sum((document_store.get_metadata(doc_id) or {}).get('size', 0) for doc_id in document_ids)
+            if total_chars // CHARS_PER_TOKEN <= full_content_budget:
+                return document_store.assemble(document_ids)
+            indexes = [get_retrieval_index(doc_id) for doc_id in document_ids]
+        else:
+            content = data.get('content', '')
+            if estimate_tokens(content) <= full_content_budget:
+                return content
+            indexes = [BM25Index.from_text(content)]
+        return select_passages(indexes, query, RETRIEVAL_TOKEN_BUDGET, RETRIEVAL_TOP_K)
+
+def parse_questions_output(output):
+    """Parse the JSON array of question/answer objects; raises ValueError if it is unusable"""
+    logger.debug("LLM Response: %s", output)
+    with stage("response_parse"):
+        questions_data = json.loads(output.strip())
+        if not isinstance(questions_data, list) or not all(
+                isinstance(item, dict) and "Question" in item and "Answer" in item for item in questions_data):
+            raise ValueError("Generated questions are missing Question/Answer keys")
+    return questions_data
+
+def request_chunk_questions(prompt, sections, chunk_hashes, scope, cache_key):
+    """One LLM call for some of the chunks that have no questions yet; stores them per chunk.
+
+    Questions that repeat one already stored for the material (scope) are dropped. Afterwards every chunk
+    of the material counts as seen, so only chunks added by a later edit trigger another call.
+    """
+    # A call that finished just before we joined may already have stored them
+    if question_bank.generated_chunks(chunk_hashes):
+        return []
+    questions_data = complete("questions", parse_questions_output,
+                              study_request(sections, prompt, model=route("questions").model))
+    grouped = question_bank.save_chunk_questions(questions_by_section(questions_data, chunk_hashes), scope)
+    question_bank.register_chunks(scope)
+    pairs = [pair for pairs in grouped.values() for pair in pairs]
+    # Keep reference answers for the local grader (duplicates are ignored)
+    storage.save_questions(pairs, source_key=cache_key)
+    return pairs
+
+def spread(items, count):
+    """Up to count items taken evenly across the list"""
+    return [items[i * len(items) // count] for i in range(count)] if len(items) > count else items
+
+def chunk_questions_call(chunk_texts, chunk_hashes, count, scope):
+    """Arguments for request_chunk_questions() asking count questions about these chunks"""
+    prompt = SECTION_PROMPT.format(count=count)
+    sections = number_sections([chunk_texts[chunk_hash] for chunk_hash in chunk_hashes])
+    cache_key = make_cache_key(route("questions").model, prompt, sections)
+    return cache_key, (prompt, sections, chunk_hashes, scope, cache_key)
+
+def generate_questions_with_ai(content, chunks=None):
+    """Generate questions for chunks of the material not seen before and reuse stored ones for the rest.
+
+    Chunks that were seen but never asked about are covered by background calls, or asked about right
+    away only when too few questions are stored to fill a set.
+    """
+    if chunks is None:
+        chunks = [(hash_content(chunk), chunk) for chunk in content_defined_chunks(content)]
+    chunk_texts = dict(chunks)
+    scope = list(chunk_texts)
+    try:
+        progress = question_bank.chunk_progress(scope)
+        new = [chunk_hash for chunk_hash in scope if chunk_hash not in progress]
+        answered = [chunk_hash for chunk_hash in scope if chunk_hash in progress and progress[chunk_hash][0] > 0]
+        unasked = [chunk_hash for chunk_hash in scope if chunk_hash in progress
+                   and progress[chunk_hash][0] == 0 and progress[chunk_hash][1] < MAX_CHUNK_ATTEMPTS]
+        llm_available = llm_provider.is_available()
+        pairs = []
+        if new and llm_available:
+            # Ask for questions in proportion to how much of the material is new, about one chunk per question
+            count = min(QUESTIONS_PER_SET, max(2, math.ceil(QUESTIONS_PER_SET * len(new) / len(scope))))
+            cache_key, args = chunk_questions_call(chunk_texts, spread(new, count), count, scope)
+            pairs = llm_flights.do(cache_key, request_chunk_questions, *args)[:QUESTIONS_PER_SET]
+        reused = []
+        if len(pairs) < QUESTIONS_PER_SET and answered:
+            reused = question_bank.sample_chunk_questions(answered, QUESTIONS_PER_SET - len(pairs))
+        if unasked and llm_available:
+            if not new and len(pairs) + len(reused) < QUESTIONS_PER_SET:
+                count = max(2, QUESTIONS_PER_SET - len(reused))
+                cache_key, args = chunk_questions_call(chunk_texts, spread(unasked, count), count, scope)
+                pairs = llm_flights.do(cache_key, request_chunk_questions, *args)[:QUESTIONS_PER_SET - len(reused)]
+            else:
+                # Cover the rest of long material in the background lane, within the prefetch budget
+                cache_key, args = chunk_questions_call(chunk_texts, spread(unasked, QUESTIONS_PER_SET),
+                                                       QUESTIONS_PER_SET, scope)
+                coverage_prefetcher.schedule(cache_key, request_chunk_questions, *args)
+        logger.info("Questions: %d new for %d new chunks, %d reused from %d covered chunks (%d not yet asked about)",
+                    len(pairs), len(new), len(reused), len(answered), len(unasked))
+        return [question for question, _ in pairs + reused] or None
     except Exception as e:
-        print(f"Error generating questions with AI: {e}")
+        logger.exception("Error generating questions with AI: %s", e)
         return None
 
+FOLLOWUP_FORMAT = " the return format must be a new line between each question and no extra characters"
+
+def build_followup_prompt(question, answer, score):
+    """Build the follow-up prompt: deeper questions for good answers, hints otherwise.
+
+    With answer=None the prompt is about the question alone (used for prefetching).
+    """
+    if answer is None:
+        quiz = " I am being quizzed on this question " + question
+    else:
+        quiz = " I was quizzed this question" + question + " and this was my answer " + answer
+    if score >= 8:
+        # Good answer - generate deeper questions
+        prompt = "I am trying to study this material." + quiz + " Give me 3 questions that help me think deeper about this content that I need to know"
+    else:
+        # Poor answer - generate clarifying questions
+        prompt = "I am trying to study this material." + quiz + " Please ask me 3 hint type questions that can guide me in the right direction to answering these questions"
+    return prompt + FOLLOWUP_FORMAT
+
+def parse_followup_line(line):
+    """Return the question on a follow-up response line, or None"""
+    line = line.strip()
+    if line.startswith('"') and line.endswith('"'):
+        return line[1:-1]
+    if '?' in line and len(line) > 10:
+        return line
+    return None
+
+def parse_followup_output(output):
+    questions = [q for q in (parse_followup_line(line) for line in output.strip().split("\n")) if q]
+    return questions[:3] if questions else None
+
+def require_followups(output):
+    """Parse a follow-up reply; raises ValueError when it contains no questions"""
+    logger.debug("Follow-up LLM Response: %s", output)
+    with stage("response_parse"):
+        questions = parse_followup_output(output)
+    if not questions:
+        raise ValueError("No follow-up questions in reply")
+    return questions
+
+def request_followups(prompt, content):
+    """One LLM call for a follow-up set"""
+    return complete("followup", require_followups, study_request(content, prompt, model=route("followup").model))
+
 def generate_followup_questions(question, answer, score, content=""):
     """Generate follow-up questions based on the answer quality"""
-    key = anthro_key()
-    llm_client = important_things[0]
-    llm_available = important_things[1]
     try:
-        if score >= 8:
-            # Good answer - generate deeper questions
-            prompt = "I am trying to study this material: " + content + " I was quizzed this question" + question + " and this was my answer " + answer + " Give me 3 questions that help me think deeper about this content that I need to know"
-        else:
-            # Poor answer - generate clarifying questions
-            prompt = "I am trying to study this material: " + content + " I was quizzed this question" + question + " and this was my answer " + answer + " Please ask me 3 hint type questions that can guide me in the right direction to answering these questions"
-        
-        format = " the return format must be a new line between each question and no extra characters"
+        prompt = build_followup_prompt(question, answer, score)
         
-        if llm_available and llm_client:
-            message = llm_client.messages.create(
-                model="claude-opus-4-1-20250805",
-                max_tokens=1024,
-                messages=[{"role": "user", "content": prompt + format}]
-            )
-            output = message.content[0].text.strip()
-            print(f"Follow-up LLM Response: {output}")
-
-            lines = output.strip().split("\n")
-            questions = []
-            for line in lines:
-                if line.startswith('"') and line.endswith('"'):
-                    questions.append(line[1:-1])
-                elif '?' in line and len(line) > 10:
-                    questions.append(line)
-            return questions[:3] if questions else None
+        if llm_provider.is_available():
+            flight_key = make_cache_key(route("followup").model, prompt, content)
+            return llm_flights.do(flight_key, request_followups, prompt, content)
         else:
             return None
     except Exception as e:
-        print(f"Error generating follow-up questions: {e}")
+        logger.exception("Error generating follow-up questions: %s", e)
         return None
 
-def grade_answer_with_ai(question, answer, content=""):
-    """Grade answer using Anthropic API or fallback"""
-    
-    try:
-        prompt = "Based on this question" + question + "check the answer against the content and score it out of 10. Content: " + content
-        llm_client = important_things[0]
-        llm_available = important_things[1]
-
-        if llm_available and llm_client:
-            message = llm_client.messages.create(
-                model="claude-opus-4-1-20250805",
-                max_tokens=1024,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            output = message.content[0].text.strip()
-            print(output)
-            print(f"Grading LLM Response: {output}")
-            
-            try:
-                result = json.loads(output)
-                if isinstance(result, dict) and 'score' in result:
-                    return result
-            except json.JSONDecodeError:
-                pass
-        
-        # Fallback grading
-        return simulate_ai_grading(question, answer, content)
-    except Exception as e:
-        print(f"Error grading with AI: {e}")
-        return simulate_ai_grading(question, answer, content)
-    
-def simulate_ai_grading(question, answer, content=""):
+def followup_tier(score):
+    return "deeper" if score >= 8 else "hint"
 
-    try:
-        prompt = "I am trying to learn this content: " + content + " The question given to me to quiz me on this content was " + question + "This was my answer: " + answer + " Please grade me out of 10 as if you were my professor with 0 being fail and 10 being above and beyond"
-        response_prompt = "Make the response format just a number (score), feedback on the next line, and suggestions on a new line. No need to include any header type words "
-
-        key = anthro_key()
-        llm_client = important_things[0]
-        llm_available = important_things[1]
-
-        if llm_available and llm_client:
-            message = llm_client.messages.create(
-                model="claude-opus-4-1-20250805",
-                max_tokens=1024,
-                messages=[{"role": "user", "content": prompt + response_prompt}]
-            )
-            # Get raw text response
-            output = message.content[0].text.strip()
-            print(f"LLM Response: {output}")
+def study_material_key(data):
+    """Identify a request's study material: its document IDs, else a hash of the inline content"""
+    return data.get('document_ids') or hash_content(data.get('content', ''))
 
-    except Exception as e:
-        print(f"Error generating questions with AI: {e}")
-        return None
-    lines = output.strip().split("\n")
+def followup_prefetch_key(question, tier, material):
+    # Keyed by material so a student is never served follow-ups built from someone else's notes
+    return make_cache_key(route("followup").model, "followup-prefetch", material, question, tier)
 
-    score = int(lines[0].strip())
-    feedback = " ".join(lines[1:-1]).strip()
-    suggestions = lines[-1].strip()
+def prefetch_followup_set(question, tier, data):
+    """Background task: one follow-up set for a question the student has not answered yet"""
+    content = resolve_study_content(data, query=question)
+    return generate_followup_questions(question, None, 10 if tier == "deeper" else 0, content)
 
-    parsed = {
-        "score": score,
-        "feedback": feedback,
-        "suggestions": suggestions
-    }
-    
-    print(type(output))
-    print(output)
+def prefetch_followups(questions, data):
+    """Speculatively generate both follow-up sets for each served question, within the prefetch budget"""
+    material = study_material_key(data)
+    for question in questions:
+        for tier in ("deeper", "hint"):
+            followup_prefetcher.schedule(followup_prefetch_key(question, tier, material),
+                                         prefetch_followup_set, question, tier, data)
 
-    return parsed
-    
+def take_prefetched_followups(question, score, material):
+    """Return the prefetched follow-up set matching this grade and study material, or None"""
+    return followup_prefetcher.take(followup_prefetch_key(question, followup_tier(score), material),
+                                    timeout=llm_executor.default_timeout)
+
+AI_GRADED_SOURCE = "AI-Graded (Anthropic)"
+LOCAL_GRADED_SOURCE = "Rule-Based"
+
+def grading_request(question, answer, content=""):
+    """One grading request; the reply is prefilled with "{" so the model answers in JSON"""
+    return study_request(content, build_grading_prompt(question, answer), prefill="{", model=route("grading").model)
+
+def parse_grade_output(output):
+    logger.debug("Grading LLM Response: %s", output)
+    with stage("response_parse"):
+        return parse_grading_response(output)
+
+def grading_cache_key(question, answer, content=""):
+    return make_cache_key(route("grading").model, GRADING_INSTRUCTIONS, question, answer, content)
+
+def local_grade(question, answer, content=""):
+    """Grade without the LLM, against the generated reference answer when we have one"""
+    with stage("fallback"):
+        reference = storage.get_reference_answer(question) or content
+        result = local_grade_answer(question, answer, reference)
+    result['source'] = LOCAL_GRADED_SOURCE
+    return result
+
+def request_grade(question, answer, content, cache_key):
+    """One structured grading call, cached once it parses"""
+    cached = response_cache.peek(cache_key)
+    if cached is not None:
+        return cached
+    result = complete("grading", parse_grade_output, grading_request(question, answer, content), prefill="{")
+    result['source'] = AI_GRADED_SOURCE
+    response_cache.set(cache_key, result)
+    return result
+
+def grade_answer_with_ai(question, answer, content=""):
+    """Grade an answer with a single structured LLM request, or the local grader as fallback"""
+    cache_key = grading_cache_key(question, answer, content)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    if llm_provider.is_available():
+        try:
+            return llm_flights.do(cache_key, request_grade, question, answer, content, cache_key)
+        except Exception as e:
+            logger.warning("Error grading with AI, using local grader: %s", e)
+
+    return local_grade(question, answer, content)
 
 def generate_fallback_questions(content):
     """Generate fallback questions when AI is not available"""
@@ -229,52 +395,9 @@ def generate_fallback_questions(content):
     ]
     return questions
 
-# def simulate_ai_grading(question, content=""):
-#     answer = content
-#     print(question in Official_Questions)
-#     if question in Official_Questions:
-#         answer = Official_Dictionary[question]
-#     print(question)
-#     print(answer)
-#     """Fallback grading system"""
-#     score = 7  # Default score
-#     feedback = "Good attempt! Your answer shows understanding of the topic."
-#     suggestions = "Try to provide more specific examples and details."
-    
-#     # Simple keyword-based scoring
-#     if len(answer) < 20:
-#         score = 3
-#         feedback = "Your answer is too brief. Please provide more detail."
-#         suggestions = "Expand your answer with specific examples and explanations."
-#     elif any(word in answer.lower() for word in ['i don\'t know', 'not sure', 'maybe']):
-#         score = 4
-#         feedback = "It's okay to be uncertain, but try to apply what you know."
-#         suggestions = "Use the study material to form a more confident answer."
-#     elif len(answer) > 100:
-#         score = 8
-#         feedback = "Excellent detailed answer! You've shown good understanding."
-#         suggestions = "Keep up the great work with detailed explanations!"
-    
-#     return {
-#         "score": score,
-#         "feedback": feedback,
-#         "suggestions": suggestions
-#     }
-
-# def generate_fallback_questions(content):
-#     """Generate fallback questions when AI is not available"""
-#     questions = [
-#         "What are the main concepts discussed in this material?",
-#         "How would you explain the key points to someone else?",
-#         "What examples can you think of that relate to this topic?",
-#         "What questions do you still have about this material?",
-#         "How does this information connect to what you already know?"
-#     ]
-#     return questions
-
 @app.route("/")
 def index():
-    return render_template("index.html")
+    return static_pages.response("index.html", request, Response)
 
 @app.route("/upload", methods=["POST"])
 def upload_files():
@@ -284,50 +407,488 @@ def upload_files():
             return jsonify({'success': False, 'message': 'No files provided'}), 400
         
         files = request.files.getlist('files')
+        user_id = current_user_id(request.form)
         uploaded_files_data = []
+        pending_files = []
+        errors = []
         
         for file in files:
             if file.filename == '':
                 continue
-                
-            # Save file temporarily
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{file.filename}") as tmp_file:
-                file.save(tmp_file.name)
-                
-                # Read content
-                content = read_file_content(tmp_file.name)
-                
-                # Store file info
-                file_data = {
-                    'id': len(uploaded_files) + 1,
-                    'filename': file.filename,
-                    'size': len(content),
-                    'content': content,
-                    'file_path': tmp_file.name,
-                    'uploaded_at': datetime.now().isoformat()
-                }
-                
-                uploaded_files.append(file_data)
-                uploaded_files_data.append(file_data)
+            
+            try:
+                upload = file.stream.finish()
+                if upload.size > INGEST_ASYNC_BYTES:
+                    # Large files are parsed off the request thread; the client polls /jobs/<job_id>
+                    try:
+                        job_id = llm_executor.submit_job(pool_task(ingest_upload), upload, file.filename, user_id)
+                    except ExecutorBusyError:
+                        upload.cleanup()
+                        raise UploadError("Server is busy, please retry this file shortly")
+                    pending_files.append({'filename': file.filename, 'size': upload.size, 'job_id': job_id})
+                else:
+                    uploaded_files_data.append(ingest_upload(upload, file.filename, user_id))
+            except UploadError as e:
+                errors.append({'filename': file.filename, 'message': str(e)})
+        
+        if not uploaded_files_data and not pending_files:
+            return jsonify({
+                'success': False,
+                'message': errors[0]['message'] if errors else 'No files provided',
+                'errors': errors
+            }), 400
         
         return jsonify({
             'success': True,
-            'message': f'Successfully uploaded {len(uploaded_files_data)} files',
-            'files': uploaded_files_data
+            'message': f'Successfully uploaded {len(uploaded_files_data)} files' + (f', {len(pending_files)} still processing' if pending_files else ''),
+            'files': uploaded_files_data,
+            'pending': pending_files,
+            'errors': errors
         })
         
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         return jsonify({
             'success': False,
             'message': f'Error uploading files: {str(e)}'
         }), 500
 
+@app.errorhandler(413)
+def request_too_large(e):
+    # A file over MAX_UPLOAD_BYTES says so; a request over MAX_REQUEST_BYTES gets the generic message
+    message = e.description if e.description != RequestEntityTooLarge.description else 'Upload is too large'
+    return jsonify({
+        'success': False,
+        'message': message
+    }), 413
+
+@app.teardown_request
+def remove_unclaimed_uploads(exc=None):
+    """Remove temp files of uploads the view did not hand over (rejected or failed requests)"""
+    for upload in getattr(request, "upload_files", ()):
+        upload.discard()
+
+def pool_task(fn):
+    """fn as handed to the worker pool: a sampled request's work is profiled on the worker thread too"""
+    if getattr(g, "profiler", None) is None:
+        return fn
+    return profiled(fn, f"{request.endpoint} (worker)")
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.profiler = start_sampled_profile()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or "unknown"
+    started = getattr(g, "request_started", None)
+    if started is not None:
+        http_latency.observe(time.perf_counter() - started, endpoint=endpoint)
+    http_requests.inc(endpoint=endpoint, status=str(response.status_code))
+    finish_sampled_profile(getattr(g, "profiler", None), endpoint)
+    return response
+
+@app.after_request
+def compress_body(response):
+    return compress_response(response, request.headers.get("Accept-Encoding"))
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus-style metrics"""
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/health", methods=["GET"])
+def health():
+    """Report whether the shared LLM client is usable"""
+    return jsonify({
+        'success': True,
+        'llm_available': llm_provider.is_available(),
+        'llm_error': llm_provider.last_error,
+        'response_cache': response_cache.stats(),
+        'llm_executor': llm_executor.stats(),
+        'followup_prefetch': followup_prefetcher.stats(),
+        'coverage_prefetch': coverage_prefetcher.stats(),
+        'coalescing': llm_flights.stats(),
+        'speech': speech_streams.stats(),
+        'model_routes': {task: task_route.to_dict() for task, task_route in ROUTES.items()},
+        'rate_limiter': llm_provider.rate_limiter.stats()
+    })
+
+@app.route("/documents", methods=["GET"])
+def list_documents():
+    """List the caller's uploaded documents (metadata only)"""
+    try:
+        documents = storage.list_uploads(current_user_id())
+        response = jsonify({
+            'success': True,
+            'documents': documents
+        })
+        return conditional_response(response, request,
+                                    parse_timestamp(documents[0]['uploaded_at']) if documents else None)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Error listing documents: {str(e)}'
+        }), 500
+
+def banked_questions_payload(content, data):
+    """Serve a question set from the offline question bank, or None if the material is not banked"""
+    document_ids = data.get('document_ids') or [hash_content(content)]
+    pairs = question_bank.sample_questions(document_ids, count=5)
+    if not pairs:
+        return None
+    questions = [question for question, _ in pairs]
+    # Keep reference answers for the local grader (duplicates are ignored)
+    storage.save_questions(pairs, source_key="question-bank")
+    logger.info("Serving %d questions from the question bank", len(questions))
+    if llm_provider.is_available():
+        prefetch_followups(questions, data)
+    return {
+        'success': True,
+        'questions': questions,
+        'source': "Question Bank",
+        'llm_available': llm_provider.is_available(),
+        'message': f'Generated {len(questions)} study questions using Question Bank'
+    }
+
+def study_chunks(content, data=None):
+    """(chunk_hash, text) pairs of the study material: stored chunks for document IDs, else inline content split"""
+    document_ids = (data or {}).get('document_ids') or []
+    if not document_ids:
+        return [(hash_content(chunk), chunk) for chunk in content_defined_chunks(content)]
+    chunks = []
+    for doc_id in document_ids:
+        doc_chunks = document_store.get_chunks(doc_id)
+        if doc_chunks is None:
+            raise UnknownDocumentError(f"Unknown document: {doc_id}")
+        chunks.extend(doc_chunks)
+    return chunks
+
+def build_questions_payload(content, data=None):
+    """Generate questions (bank, then AI, then smart fallback) and build the response body"""
+    if data is not None:
+        banked = banked_questions_payload(content, data)
+        if banked:
+            return banked
+    logger.info("Generating questions for %d characters of content", len(content))
+    
+    # Try AI first, fallback to smart questions
+    ai_questions = generate_questions_with_ai(content, study_chunks(content, data))
+    
+    if ai_questions:
+        questions = ai_questions
+        source = "AI-Generated (Anthropic)"
+        logger.info("Generated %d questions using Anthropic AI", len(questions))
+        if data is not None:
+            prefetch_followups(questions, data)
+    else:
+        # Fallback to smart questions
+        with stage("fallback"):
+            questions = generate_fallback_questions(content)
+        source = "Smart-Generated"
+        logger.warning("Using smart fallback questions")
+    return {
+        'success': True,
+        'questions': questions,
+        'source': source,
+        'llm_available': llm_provider.is_available(),
+        'message': f'Generated {len(questions)} study questions using {source}'
+    }
+
+def build_followup_payload(question, answer, score, content, material, use_ai=True):
+    """Generate follow-up questions (AI first, smart fallback) and build the response body"""
+    logger.info("Generating follow-up questions for score: %s/10", score)
+    
+    followup_questions = None
+    if use_ai:
+        followup_questions = take_prefetched_followups(question, score, material)
+        if followup_questions:
+            logger.info("Serving prefetched follow-up questions")
+        else:
+            followup_questions = generate_followup_questions(question, answer, score, content)
+    
+    if followup_questions:
+        source = "AI-Generated Follow-ups"
+        logger.info("Generated %d follow-up questions", len(followup_questions))
+    else:
+        # Fallback follow-up questions
+        if score >= 8:
+            followup_questions = [
+                "Can you provide a real-world example of this concept?",
+                "How would you apply this knowledge in a different context?",
+                "What are the implications of this concept?"
+            ]
+        else:
+            followup_questions = [
+                "Can you explain this concept in simpler terms?",
+                "What part of this topic would you like to review?",
+                "How does this relate to the main study material?"
+            ]
+        source = "Smart Follow-ups"
+        logger.warning("Using smart follow-up questions")
+    return {
+        'success': True,
+        'questions': followup_questions,
+        'source': source,
+        'llm_available': llm_provider.is_available(),
+        'message': f'Generated {len(followup_questions)} follow-up questions'
+    }
+
+def build_grade_payload(question, answer, content):
+    """Grade an answer and build the response body"""
+    logger.info("Grading answer (%d characters)", len(answer))
+    
+    # Grade using AI or fallback
+    grade_result = grade_answer_with_ai(question, answer, content)
+    return grade_result_payload(grade_result)
+
+def grade_result_payload(grade_result):
+    """Build the response body for a grading result"""
+    score = grade_result.get('score', 7)
+    feedback = grade_result.get('feedback', 'Good attempt!')
+    suggestions = grade_result.get('suggestions', 'Keep practicing!')
+    
+    is_correct = score >= 7
+    llm_available = llm_provider.is_available()
+    source = grade_result.get('source', LOCAL_GRADED_SOURCE)
+    logger.info("Graded using %s: %s/10", source, score)
+    
+    return {
+        'success': True,
+        'score': score,
+        'is_correct': is_correct,
+        'feedback': feedback,
+        'suggestions': suggestions,
+        'message': 'Answer graded successfully',
+        'source': source,
+        'llm_available': llm_available
+    }
+
+MAX_BATCH_ITEMS = 20
+
+def parse_batch_output(output, count):
+    """Parse a batch grading reply; raises ValueError only when no answer could be graded"""
+    logger.debug("Batch Grading LLM Response: %s", output)
+    with stage("response_parse"):
+        results = parse_batch_grading_response(output, count)
+    if all(result is None for result in results):
+        raise ValueError("Batch grading reply has no usable grades")
+    return results
+
+def grade_batch_with_ai(items, content=""):
+    """Grade a whole session's answers with one LLM request; cached and unusable items are handled per answer"""
+    results = [response_cache.get(grading_cache_key(item['question'], item['answer'], content)) for item in items]
+    pending = [index for index, result in enumerate(results) if result is None]
+
+    if pending and llm_provider.is_available():
+        pending_items = [items[index] for index in pending]
+        try:
+            batch_results = complete(
+                "batch_grading",
+                lambda output: parse_batch_output(output, len(pending_items)),
+                study_request(content, build_batch_grading_prompt(pending_items), prefill="[",
+                              model=route("batch_grading").model),
+                max_tokens=min(4096, route("batch_grading").max_tokens * len(pending_items)),
+                prefill="["
+            )
+            for index, result in zip(pending, batch_results):
+                if result is not None:
+                    result['source'] = AI_GRADED_SOURCE
+                    response_cache.set(grading_cache_key(items[index]['question'], items[index]['answer'], content), result)
+                    results[index] = result
+        except Exception as e:
+            logger.warning("Error batch grading with AI, using local grader: %s", e)
+
+    return [
+        result if result is not None else local_grade(item['question'], item['answer'], content)
+        for item, result in zip(items, results)
+    ]
+
+def build_batch_grade_payload(items, content):
+    """Grade every answer in a session and build the response body"""
+    logger.info("Batch grading %d answers", len(items))
+    results = [grade_result_payload(result) for result in grade_batch_with_ai(items, content)]
+    scores = [result['score'] for result in results]
+    return {
+        'success': True,
+        'results': results,
+        'total_score': sum(scores),
+        'average_score': sum(scores) / len(scores),
+        'accuracy': 100 * sum(1 for result in results if result['is_correct']) / len(results),
+        'llm_available': llm_provider.is_available(),
+        'message': f'Graded {len(results)} answers'
+    }
+
+def sse_event(event, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(events):
+    return Response(stream_with_context(events), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def llm_event_stream(events, action):
+    """Produce SSE events on the LLM worker pool, so streams count against its concurrency limit"""
+    if getattr(g, "profiler", None) is not None:
+        events = profiled_iter(events, f"{request.endpoint} (worker)")
+    items = llm_executor.stream(events)
+
+    def relay():
+        try:
+            yield from items
+        except LLMTimeoutError as e:
+            yield sse_event('error', {'success': False, 'message': f'Error {action}: {str(e)}'})
+    return relay()
+
+def wants_stream(data):
+    return bool(data.get('stream')) or request.accept_mimetypes.best == 'text/event-stream'
+
+def stream_grade_events(question, answer, content):
+    """Grade an answer, sending the score as soon as it is generated and then streaming feedback"""
+    try:
+        cache_key = grading_cache_key(question, answer, content)
+        grade_result = response_cache.get(cache_key)
+        score_sent = False
+
+        if grade_result is None and llm_provider.is_available():
+            output = "{"
+            feedback_sent = ""
+            try:
+                for text in llm_provider.stream_text(
+                    model=route("grading").model,
+                    max_tokens=route("grading").max_tokens,
+                    **grading_request(question, answer, content)
+                ):
+                    output += text
+                    if not score_sent:
+                        score = partial_score(output)
+                        if score is not None:
+                            yield sse_event('score', {'score': score})
+                            score_sent = True
+                    feedback = partial_string_field(output, 'feedback')
+                    if len(feedback) > len(feedback_sent):
+                        yield sse_event('feedback', {'text': feedback[len(feedback_sent):]})
+                        feedback_sent = feedback
+                try:
+                    grade_result = parse_grade_output(output)
+                except (ValueError, KeyError, TypeError):
+                    grade_result = escalate("grading", parse_grade_output,
+                                            grading_request(question, answer, content), prefill="{")
+                grade_result['source'] = AI_GRADED_SOURCE
+                response_cache.set(cache_key, grade_result)
+            except Exception as e:
+                logger.warning("Error streaming grade from AI, using local grader: %s", e)
+
+        if grade_result is None:
+            grade_result = local_grade(question, answer, content)
+        if not score_sent:
+            yield sse_event('score', {'score': grade_result['score']})
+        yield sse_event('result', grade_result_payload(grade_result))
+    except Exception as e:
+        yield sse_event('error', {'success': False, 'message': f'Error grading answer: {str(e)}'})
+
+def stream_followup_events(question, answer, score, content, material):
+    """Generate follow-up questions, sending each one as soon as its line is complete"""
+    try:
+        questions = take_prefetched_followups(question, score, material) or []
+        for followup in questions:
+            yield sse_event('question', {'question': followup})
+        if not questions and llm_provider.is_available():
+            buffer = ""
+            followup_request = study_request(content, build_followup_prompt(question, answer, score),
+                                             model=route("followup").model)
+            for text in llm_provider.stream_text(
+                model=route("followup").model,
+                max_tokens=route("followup").max_tokens,
+                **followup_request
+            ):
+                buffer += text
+                while "\n" in buffer and len(questions) < 3:
+                    line, buffer = buffer.split("\n", 1)
+                    followup = parse_followup_line(line)
+                    if followup:
+                        questions.append(followup)
+                        yield sse_event('question', {'question': followup})
+            followup = parse_followup_line(buffer)
+            if followup and len(questions) < 3:
+                questions.append(followup)
+                yield sse_event('question', {'question': followup})
+            if not questions and route("followup").escalate_to:
+                try:
+                    questions = escalate("followup", require_followups, followup_request)
+                except Exception as e:
+                    logger.warning("Escalated follow-up generation failed: %s", e)
+                for followup in questions:
+                    yield sse_event('question', {'question': followup})
+
+        if questions:
+            payload = {
+                'success': True,
+                'questions': questions,
+                'source': "AI-Generated Follow-ups",
+                'llm_available': llm_provider.is_available(),
+                'message': f'Generated {len(questions)} follow-up questions'
+            }
+        else:
+            payload = build_followup_payload(question, answer, score, content, material, use_ai=False)
+            for followup in payload['questions']:
+                yield sse_event('question', {'question': followup})
+        yield sse_event('result', payload)
+    except Exception as e:
+        yield sse_event('error', {'success': False, 'message': f'Error generating follow-up questions: {str(e)}'})
+
+def run_llm_task(data, fn, *args):
+    """Run an LLM-bound task on the worker pool, or queue it as a job if the client asked for async"""
+    fn = pool_task(fn)
+    if data.get('async'):
+        job_id = llm_executor.submit_job(fn, *args)
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status': 'queued',
+            'message': 'Request queued, poll /jobs/<job_id> for the result'
+        }), 202
+    return jsonify(llm_executor.run(fn, *args))
+
+def llm_error_response(e, action):
+    """Map executor and document errors onto HTTP status codes"""
+    if isinstance(e, UnknownDocumentError):
+        return jsonify({
+            'success': False,
+            'message': 'Study material not found, please upload it again'
+        }), 404
+    if isinstance(e, ExecutorBusyError):
+        status = 503
+    elif isinstance(e, LLMTimeoutError):
+        status = 504
+    else:
+        status = 500
+    return jsonify({
+        'success': False,
+        'message': f'Error {action}: {str(e)}'
+    }), status
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Poll the result of a queued LLM request"""
+    job = llm_executor.job_status(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'message': 'Unknown or expired job'
+        }), 404
+    return jsonify({'success': True, 'job_id': job_id, **job})
+
 @app.route("/generate_questions", methods=["POST"])
 def generate_questions():
     """Generate study questions based on uploaded content using AI"""
     try:
         data = request.get_json()
-        content = data.get('content', '')
+        content = resolve_study_content(data)
         
         if not content:
             return jsonify({
@@ -335,36 +896,10 @@ def generate_questions():
                 'message': 'No content provided for question generation'
             }), 400
         
-        print(f"Generating questions for content: {content[:100]}...")
-        
-        # Try AI first, fallback to smart questions
-        ai_questions = generate_questions_with_ai(content)
-        
-        if ai_questions:
-            questions = ai_questions
-            source = "AI-Generated (Anthropic)"
-            print(f"✅ Generated {len(questions)} questions using Anthropic AI")
-        else:
-            # Fallback to smart questions
-            questions = generate_fallback_questions(content)
-            source = "Smart-Generated"
-            print(f"⚠️ Using smart fallback questions")
-        key = anthro_key()
-        llm_client = important_things[0]
-        llm_available = important_things[1]
-        return jsonify({
-            'success': True,
-            'questions': questions,
-            'source': source,
-            'llm_available': llm_available,
-            'message': f'Generated {len(questions)} study questions using {source}'
-        })
+        return run_llm_task(data, build_questions_payload, content, data)
         
     except Exception as e:
-        return jsonify({
-            'success': False,
-            'message': f'Error generating questions: {str(e)}'
-        }), 500
+        return llm_error_response(e, 'generating questions')
 
 @app.route("/generate_followup", methods=["POST"])
 def generate_followup():
@@ -374,7 +909,7 @@ def generate_followup():
         question = data.get('question', '')
         answer = data.get('answer', '')
         score = data.get('score', 0)
-        content = data.get('content', '')
+        content = resolve_study_content(data, query=f"{question} {answer}")
         
         if not question or not answer:
             return jsonify({
@@ -382,55 +917,23 @@ def generate_followup():
                 'message': 'Question and answer are required'
             }), 400
         
-        print(f"Generating follow-up questions for score: {score}/10")
-        
-        followup_questions = generate_followup_questions(question, answer, score, content)
-        
-        if followup_questions:
-            source = "AI-Generated Follow-ups"
-            print(f"✅ Generated {len(followup_questions)} follow-up questions")
-        else:
-            # Fallback follow-up questions
-            if score >= 8:
-                followup_questions = [
-                    "Can you provide a real-world example of this concept?",
-                    "How would you apply this knowledge in a different context?",
-                    "What are the implications of this concept?"
-                ]
-            else:
-                followup_questions = [
-                    "Can you explain this concept in simpler terms?",
-                    "What part of this topic would you like to review?",
-                    "How does this relate to the main study material?"
-                ]
-            source = "Smart Follow-ups"
-            print(f"⚠️ Using smart follow-up questions")
-        key = anthro_key()
-        llm_client = important_things[0]
-        llm_available = important_things[1]
-        return jsonify({
-            'success': True,
-            'questions': followup_questions,
-            'source': source,
-            'llm_available': llm_available,
-            'message': f'Generated {len(followup_questions)} follow-up questions'
-        })
+        material = study_material_key(data)
+        if wants_stream(data):
+            return sse_response(llm_event_stream(stream_followup_events(question, answer, score, content, material),
+                                                 'generating follow-up questions'))
+        return run_llm_task(data, build_followup_payload, question, answer, score, content, material)
         
     except Exception as e:
-        return jsonify({
-            'success': False,
-            'message': f'Error generating follow-up questions: {str(e)}'
-        }), 500
+        return llm_error_response(e, 'generating follow-up questions')
 
 @app.route("/grade_answer", methods=["POST"])
 def grade_answer():
     """Grade student answers using AI"""
     try:
         data = request.get_json()
-        print(data)
         question = data.get('question', '')
         answer = data.get('answer', '')
-        content = data.get('content', '')
+        content = resolve_study_content(data, query=f"{question} {answer}")
         
         if not question or not answer:
             return jsonify({
@@ -438,38 +941,115 @@ def grade_answer():
                 'message': 'Question and answer are required'
             }), 400
         
-        print(f"Grading answer: {answer[:50]}...")
+        if wants_stream(data):
+            return sse_response(llm_event_stream(stream_grade_events(question, answer, content), 'grading answer'))
+        return run_llm_task(data, build_grade_payload, question, answer, content)
         
-        # Grade using AI or fallback
-        grade_result = simulate_ai_grading(question, answer, content)
+    except Exception as e:
+        return llm_error_response(e, 'grading answer')
+
+@app.route("/grade_batch", methods=["POST"])
+def grade_batch():
+    """Grade all (question, answer) pairs of a study session in one request"""
+    try:
+        data = request.get_json()
+        items = data.get('items') or []
         
-        score = grade_result.get('score', 7)
-        feedback = grade_result.get('feedback', 'Good attempt!')
-        suggestions = grade_result.get('suggestions', 'Keep practicing!')
+        if not isinstance(items, list) or not items:
+            return jsonify({
+                'success': False,
+                'message': 'A non-empty list of items is required'
+            }), 400
+        if len(items) > MAX_BATCH_ITEMS:
+            return jsonify({
+                'success': False,
+                'message': f'At most {MAX_BATCH_ITEMS} answers can be graded per batch'
+            }), 400
+        if not all(isinstance(item, dict) and item.get('question') and item.get('answer') for item in items):
+            return jsonify({
+                'success': False,
+                'message': 'Every item needs a question and an answer'
+            }), 400
         
-        is_correct = score >= 7
-        key = anthro_key()
-        llm_client = important_things[0]
-        llm_available = important_things[1]
-        source = "AI-Graded (Anthropic)" if llm_available else "Rule-Based"
-        print(f"✅ Graded using {source}: {score}/10")
-        
-        return jsonify({
-            'success': True,
-            'score': score,
-            'is_correct': is_correct,
-            'feedback': feedback,
-            'suggestions': suggestions,
-            'message': 'Answer graded successfully',
-            'source': source,
-            'llm_available': llm_available
-        })
+        items = [{'question': item['question'], 'answer': item['answer']} for item in items]
+        content = resolve_study_content(data, query=" ".join(f"{item['question']} {item['answer']}" for item in items))
+        return run_llm_task(data, build_batch_grade_payload, items, content)
         
     except Exception as e:
-        return jsonify({
-            'success': False,
-            'message': f'Error grading answer: {str(e)}'
-        }), 500
+        return llm_error_response(e, 'grading answers')
+
+def speech_error_response(e):
+    """Map speech errors onto HTTP status codes"""
+    status = 503 if isinstance(e, SpeechUnavailableError) else 400
+    return jsonify({
+        'success': False,
+        'message': str(e)
+    }), status
+
+@app.route("/speech")
+def speech_page():
+    return static_pages.response("speech_to_text.html", request, Response)
+
+@app.route("/speech_to_text", methods=["POST"])
+def speech_to_text():
+    """Transcribe a complete 16-bit mono WAV recording"""
+    try:
+        upload = request.files.get('file')
+        if upload is None:
+            return jsonify({'success': False, 'message': 'No audio provided'}), 400
+        with stage("speech_decode"):
+            transcript = speech_streams.transcribe_wav(upload.read())
+        return jsonify({'success': True, 'transcript': transcript})
+    except (SpeechError, SpeechUnavailableError) as e:
+        return speech_error_response(e)
+
+@app.route("/speech_to_text/start", methods=["POST"])
+def start_speech_stream():
+    """Open a streamed recording; the client then sends PCM chunks as the student speaks"""
+    try:
+        data = request.get_json(silent=True) or {}
+        sample_rate = int(data.get('sample_rate') or DEFAULT_SAMPLE_RATE)
+        if not 8000 <= sample_rate <= 48000:
+            raise SpeechError("sample_rate must be between 8000 and 48000")
+        stream = speech_streams.start(sample_rate)
+        return jsonify({'success': True, 'stream_id': stream.id, 'sample_rate': sample_rate})
+    except (SpeechError, SpeechUnavailableError) as e:
+        return speech_error_response(e)
+
+@app.route("/speech_to_text/<stream_id>/chunk", methods=["POST"])
+def speech_chunk(stream_id):
+    """Transcribe the next chunk (raw 16-bit mono PCM, numbered by ?seq=) and return the partial transcript"""
+    try:
+        seq = request.args.get('seq', type=int)
+        if seq is None:
+            raise SpeechError("seq is required")
+        with stage("speech_decode"):
+            partial = speech_streams.feed(stream_id, seq, request.get_data())
+        return jsonify({'success': True, 'seq': seq, 'partial': partial})
+    except (SpeechError, SpeechUnavailableError) as e:
+        return speech_error_response(e)
+
+@app.route("/speech_to_text/<stream_id>/finish", methods=["POST"])
+def finish_speech_stream(stream_id):
+    """Close a recording and return the final transcript, graded straight away when a question is given"""
+    try:
+        data = request.get_json(silent=True) or {}
+        with stage("speech_decode"):
+            transcript = speech_streams.finish(stream_id)
+    except (SpeechError, SpeechUnavailableError) as e:
+        return speech_error_response(e)
+
+    result = {'success': True, 'transcript': transcript}
+    question = data.get('question', '')
+    if question and transcript:
+        try:
+            content = resolve_study_content(data, query=f"{question} {transcript}")
+            result['grade'] = llm_executor.run(build_grade_payload, question, transcript, content)
+        except Exception as e:
+            # Keep the transcript so the client can still submit it through /grade_answer
+            logger.warning("Grading spoken answer failed: %s", e)
+            result['grade_error'] = f'Error grading answer: {str(e)}'
+    return jsonify(result)
 
 @app.route("/save_session", methods=["POST"])
 def save_session():
@@ -477,17 +1057,14 @@ def save_session():
     try:
         data = request.get_json()
         
-        session_data = {
-            'id': len(study_sessions) + 1,
-            'timestamp': datetime.now().isoformat(),
+        session_data = storage.save_session(current_user_id(data), {
             'questions': data.get('questions', []),
             'answers': data.get('answers', []),
             'scores': data.get('scores', []),
             'total_score': data.get('total_score', 0),
-            'accuracy': data.get('accuracy', 0)
-        }
-        
-        study_sessions.append(session_data)
+            'accuracy': data.get('accuracy', 0),
+            'topic': data.get('topic')
+        })
         
         return jsonify({
             'success': True,
@@ -501,36 +1078,65 @@ def save_session():
             'message': f'Error saving session: {str(e)}'
         }), 500
 
+MAX_ANALYTICS_PAGE_SIZE = 100
+
+def is_iso_date(value):
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+        return True
+    except ValueError:
+        return False
+
 @app.route("/analytics", methods=["GET"])
 def get_analytics():
-    """Get study analytics"""
+    """Get study analytics (?user_id=, ?since=/until= dates as YYYY-MM-DD, ?page=/page_size=)
+
+    Windows are whole days: since is inclusive, until exclusive, for both the session list and the summary.
+    """
     try:
-        if not study_sessions:
-            return jsonify({
-                'success': True,
-                'analytics': {
-                    'total_sessions': 0,
-                    'average_score': 0,
-                    'average_accuracy': 0,
-                    'sessions': []
-                }
-            })
+        user_id = request.args.get('user_id')
+        since = request.args.get('since')
+        until = request.args.get('until')
+        for name, value in (('since', since), ('until', until)):
+            if value and not is_iso_date(value):
+                return jsonify({
+                    'success': False,
+                    'message': f'{name} must be a date (YYYY-MM-DD); analytics windows are whole days'
+                }), 400
+        page = max(request.args.get('page', 1, type=int), 1)
+        page_size = min(max(request.args.get('page_size', 10, type=int), 1), MAX_ANALYTICS_PAGE_SIZE)
         
-        total_sessions = len(study_sessions)
-        total_score = sum(session.get('total_score', 0) for session in study_sessions)
-        total_accuracy = sum(session.get('accuracy', 0) for session in study_sessions)
-        
-        analytics = {
-            'total_sessions': total_sessions,
-            'average_score': total_score / total_sessions if total_sessions > 0 else 0,
-            'average_accuracy': total_accuracy / total_sessions if total_sessions > 0 else 0,
-            'sessions': study_sessions[-10:]  # Last 10 sessions
-        }
+        # All-time numbers come from running aggregates, never from scanning sessions
+        analytics = storage.analytics_summary(user_id)
+        # Daily rollups default to the last 30 days so the response stays small
+        daily_since = since or (datetime.now() - timedelta(days=30)).date().isoformat()
+        daily = storage.daily_analytics(user_id, daily_since, until)
+        analytics.update({
+            'sessions': storage.list_sessions(user_id, limit=page_size, offset=(page - 1) * page_size,
+                                              since=since, until=until),
+            'page': page,
+            'page_size': page_size,
+            'daily': daily,
+            'topics': storage.topic_analytics(user_id),
+            'score_histogram': storage.score_histogram(user_id)
+        })
+        if since or until:
+            # The daily list defaults to the last 30 days; the window uses exactly the requested bounds
+            window_days = daily if since else storage.daily_analytics(user_id, since, until)
+            window_sessions = sum(day['total_sessions'] for day in window_days)
+            analytics['window'] = {
+                'since': since,
+                'until': until,
+                'total_sessions': window_sessions,
+                'average_score': sum(day['average_score'] * day['total_sessions'] for day in window_days) / window_sessions if window_sessions else 0,
+                'average_accuracy': sum(day['average_accuracy'] * day['total_sessions'] for day in window_days) / window_sessions if window_sessions else 0
+            }
         
-        return jsonify({
+        response = jsonify({
             'success': True,
             'analytics': analytics
         })
+        return conditional_response(response, request, parse_timestamp(storage.analytics_updated_at(user_id)))
         
     except Exception as e:
         return jsonify({
@@ -542,4 +1148,4 @@ if __name__ == "__main__":
     print("🎓 Starting StudyAI - AI-Powered Study Assistant...")
     print("📱 Open your browser and go to: http://localhost:8080")
     print("🎤 Ready to help you study with AI!")
-    app.run(host="0.0.0.0", port=8080, debug=True)
+    app.run(host="0.0.0.0", port=8080, debug=True, threaded=True)
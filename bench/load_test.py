@@ -0,0 +1,332 @@
+"""Load test for StudyAI against the local mock LLM.
+
+By default this starts the mock Messages API and the Flask app (pointed at the
+mock through ANTHROPIC_BASE_URL, with throwaway storage), then runs concurrent
+simulated students. Each session uploads a document, generates 5 questions,
+grades and asks for follow-ups on every answer and saves the session. It
+reports per-endpoint p50/p95/p99 latency, requests/s and the app's memory
+growth, and exits non-zero when --max-p95 or --max-error-rate is exceeded.
+
+    python bench/load_test.py --users 16 --duration 60
+    python bench/load_test.py --app-url http://localhost:8080 --users 4 --sessions 10
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_llm import add_mock_arguments, config_from_args, start_mock_server
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIZE_SUFFIXES = {"k": 1024, "m": 1024 * 1024}
+
+
+def parse_size(value):
+    value = value.strip().lower()
+    if value and value[-1] in SIZE_SUFFIXES:
+        return int(float(value[:-1]) * SIZE_SUFFIXES[value[-1]])
+    return int(value)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def read_rss_bytes(pid):
+    """Resident memory of a process from /proc (Linux only, None elsewhere)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def build_document(size, rng):
+    """Study material of roughly `size` bytes built from the sample content"""
+    with open(os.path.join(REPO_ROOT, "sample_content.txt"), encoding="utf-8") as f:
+        base = f.read()
+    words = base.split()
+    parts = [f"Study notes {uuid.uuid4().hex}\n\n"]
+    total = len(parts[0])
+    while total < size:
+        sentence = " ".join(rng.choice(words) for _ in range(rng.randint(8, 20))) + ".\n"
+        parts.append(sentence)
+        total += len(sentence)
+    return "".join(parts)[:max(size, 1)]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, seconds, ok):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def total_requests(self):
+        return sum(len(values) for values in self.latencies.values())
+
+    def total_errors(self):
+        return sum(self.errors.values())
+
+
+class Client:
+    def __init__(self, base_url, recorder, user_id, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.recorder = recorder
+        self.user_id = user_id
+        self.timeout = timeout
+
+    def request(self, endpoint, path, body=None, content_type="application/json", method="POST"):
+        headers = {"X-User-Id": self.user_id}
+        if body is not None:
+            headers["Content-Type"] = content_type
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        start = time.perf_counter()
+        status = 0
+        payload = None
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                status = response.status
+                payload = json.loads(response.read() or b"null")
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except (urllib.error.URLError, OSError, ValueError):
+            status = 0
+        ok = 200 <= status < 300 and (not isinstance(payload, dict) or payload.get("success", True))
+        self.recorder.record(endpoint, time.perf_counter() - start, ok)
+        return payload if ok else None
+
+    def post_json(self, path, data):
+        return self.request(path, path, json.dumps(data).encode("utf-8"))
+
+    def upload(self, filename, text):
+        boundary = "bench" + uuid.uuid4().hex
+        body = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="files"; filename="{filename}"\r\n'
+            "Content-Type: text/plain\r\n\r\n"
+        ).encode("utf-8") + text.encode("utf-8") + f"\r\n--{boundary}--\r\n".encode("utf-8")
+        return self.request("/upload", "/upload", body, f"multipart/form-data; boundary={boundary}")
+
+    def wait_for_job(self, job_id, deadline):
+        while time.time() < deadline:
+            payload = self.request("/jobs", f"/jobs/{job_id}", method="GET")
+            if payload is None:
+                return None
+            if payload.get("status") == "done":
+                return payload.get("result")
+            if payload.get("status") == "failed":
+                return None
+            time.sleep(0.2)
+        return None
+
+
+def run_session(client, document, rng):
+    """One study session: upload, generate, grade + follow-up per question, save"""
+    uploaded = client.upload(f"notes-{uuid.uuid4().hex[:8]}.txt", document)
+    if uploaded is None:
+        return
+    files = uploaded.get("files") or []
+    for pending in uploaded.get("pending") or []:
+        result = client.wait_for_job(pending["job_id"], time.time() + client.timeout)
+        if result:
+            files.append(result)
+    document_ids = [f["id"] for f in files if "id" in f]
+    if not document_ids:
+        return
+
+    generated = client.post_json("/generate_questions", {"document_ids": document_ids})
+    if generated is None:
+        return
+    questions, answers, scores = [], [], []
+    for question in generated.get("questions", [])[:5]:
+        answer = rng.choice(["It relates the key terms", "I am not sure",
+                             "The material explains the idea and how it relates to the surrounding ideas."])
+        graded = client.post_json("/grade_answer", {"question": question, "answer": answer, "document_ids": document_ids})
+        score = (graded or {}).get("score", 0)
+        client.post_json("/generate_followup", {"question": question, "answer": answer, "score": score,
+                                                "document_ids": document_ids})
+        questions.append(question)
+        answers.append(answer)
+        scores.append(score)
+
+    total = sum(scores)
+    client.post_json("/save_session", {
+        "questions": questions,
+        "answers": answers,
+        "scores": scores,
+        "total_score": total,
+        "accuracy": total / (len(scores) * 10) * 100 if scores else 0,
+        "topic": "benchmark"
+    })
+
+
+def worker(index, args, recorder, stop_at, documents):
+    rng = random.Random((args.seed or 0) + index)
+    client = Client(args.app_url, recorder, f"bench-user-{index}", args.timeout)
+    sessions = 0
+    while time.time() < stop_at and (not args.sessions or sessions < args.sessions):
+        run_session(client, rng.choice(documents), rng)
+        sessions += 1
+
+
+def start_app(mock_url, port, workdir):
+    env = dict(os.environ)
+    env.update({
+        "ANTHROPIC_API_KEY": "bench-key",
+        "ANTHROPIC_BASE_URL": mock_url,
+        "STORAGE_PATH": os.path.join(workdir, "studyai.db"),
+        "DOCUMENT_STORE_DIR": os.path.join(workdir, "documents"),
+        "QUESTION_BANK_PATH": os.path.join(workdir, "question_bank.db"),
+        "LOG_LEVEL": env.get("LOG_LEVEL", "WARNING")
+    })
+    code = f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"
+    return subprocess.Popen([sys.executable, "-c", code], cwd=REPO_ROOT, env=env)
+
+
+def wait_until_ready(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url + "/health", timeout=2):
+                return True
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    return False
+
+
+def report(recorder, elapsed, rss_start, rss_end):
+    results = {"elapsed_seconds": elapsed, "endpoints": {}}
+    print(f"\n{'endpoint':<22}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint in sorted(recorder.latencies):
+        values = recorder.latencies[endpoint]
+        stats = {
+            "count": len(values),
+            "errors": recorder.errors[endpoint],
+            "p50": percentile(values, 0.50),
+            "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99)
+        }
+        results["endpoints"][endpoint] = stats
+        print(f"{endpoint:<22}{stats['count']:>7}{stats['errors']:>8}"
+              f"{stats['p50'] * 1000:>10.1f}{stats['p95'] * 1000:>10.1f}{stats['p99'] * 1000:>10.1f}")
+
+    total = recorder.total_requests()
+    results["requests_per_second"] = total / elapsed if elapsed else 0
+    results["error_rate"] = recorder.total_errors() / total if total else 0
+    print(f"\n{total} requests in {elapsed:.1f}s: {results['requests_per_second']:.1f} req/s, "
+          f"error rate {results['error_rate']:.2%}")
+    if rss_start is not None and rss_end is not None:
+        results["rss_start_bytes"] = rss_start
+        results["rss_end_bytes"] = rss_end
+        results["rss_growth_bytes"] = rss_end - rss_start
+        print(f"App RSS: {rss_start / 1e6:.1f} MB -> {rss_end / 1e6:.1f} MB "
+              f"({(rss_end - rss_start) / 1e6:+.1f} MB)")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test StudyAI against a mock LLM")
+    parser.add_argument("--app-url", help="Benchmark an already running app instead of starting one")
+    parser.add_argument("--users", type=int, default=8, help="Concurrent simulated students (default 8)")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run (default 30)")
+    parser.add_argument("--sessions", type=int, default=0, help="Stop each user after this many sessions")
+    parser.add_argument("--upload-sizes", default="4k,64k,512k",
+                        help="Comma-separated document sizes to upload, e.g. 4k,256k,3m (default 4k,64k,512k)")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds")
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this JSON file")
+    parser.add_argument("--max-p95", type=float, help="Fail if any endpoint's p95 exceeds this many seconds")
+    parser.add_argument("--max-error-rate", type=float, help="Fail if the overall error rate exceeds this fraction")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    documents = [build_document(parse_size(size), rng) for size in args.upload_sizes.split(",") if size.strip()]
+
+    mock = None
+    app_process = None
+    workdir = None
+    if not args.app_url:
+        mock = start_mock_server(0, config_from_args(args))
+        mock_url = f"http://127.0.0.1:{mock.server_address[1]}"
+        workdir = tempfile.TemporaryDirectory(prefix="studyai_bench_")
+        port = free_port()
+        app_process = start_app(mock_url, port, workdir.name)
+        args.app_url = f"http://127.0.0.1:{port}"
+        print(f"Mock LLM at {mock_url}, app at {args.app_url}")
+
+    try:
+        if not wait_until_ready(args.app_url):
+            print("App did not become ready", file=sys.stderr)
+            return 2
+        rss_start = read_rss_bytes(app_process.pid) if app_process else None
+
+        recorder = Recorder()
+        started = time.time()
+        stop_at = started + args.duration
+        threads = [threading.Thread(target=worker, args=(i, args, recorder, stop_at, documents), daemon=True)
+                   for i in range(args.users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - started
+
+        rss_end = read_rss_bytes(app_process.pid) if app_process else None
+        results = report(recorder, elapsed, rss_start, rss_end)
+        if args.json_path:
+            with open(args.json_path, "w") as f:
+                json.dump(results, f, indent=2)
+
+        failed = False
+        if args.max_p95 is not None:
+            slow = [name for name, stats in results["endpoints"].items() if stats["p95"] > args.max_p95]
+            if slow:
+                print(f"p95 above {args.max_p95}s for: {', '.join(slow)}", file=sys.stderr)
+                failed = True
+        if args.max_error_rate is not None and results["error_rate"] > args.max_error_rate:
+            print(f"Error rate {results['error_rate']:.2%} above {args.max_error_rate:.2%}", file=sys.stderr)
+            failed = True
+        return 1 if failed else 0
+    finally:
+        if app_process:
+            app_process.terminate()
+            app_process.wait(timeout=10)
+        if mock:
+            mock.shutdown()
+        if workdir:
+            workdir.cleanup()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
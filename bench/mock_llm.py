@@ -0,0 +1,285 @@
+"""Local stand-in for the Anthropic Messages API used by the benchmarks.
+
+Answers POST /v1/messages (plain and streaming) with replies shaped like the
+ones StudyAI expects: a JSON array of questions, a grading object continuing
+the "{" prefill, a batch grading array or plain follow-up lines. Latency,
+output token rate, malformed replies and error responses are configurable so
+the app can be measured without spending real tokens. System blocks marked
+with cache_control are reported as prompt-cache writes, then reads.
+
+    python bench/mock_llm.py --port 8089 --latency 0.3 --tokens-per-second 80
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHARS_PER_TOKEN = 4
+
+
+class MockConfig:
+    def __init__(self, latency=0.2, jitter=0.1, tokens_per_second=100.0,
+                 malformed_rate=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.malformed_rate = malformed_rate
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.cached_prefixes = set()
+
+    def roll(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+    def first_token_delay(self):
+        with self.lock:
+            return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def message_text(message):
+    content = message.get("content", "")
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content if block.get("type") == "text")
+
+
+def system_text(body):
+    system = body.get("system") or ""
+    if isinstance(system, str):
+        return system
+    return "".join(block.get("text", "") for block in system)
+
+
+QUESTION_TEMPLATES = [
+    "What is the main idea behind {term} in this material?",
+    "How would you explain {term} to a classmate who missed the lecture?",
+    "Why does {term} matter for the rest of the topic?",
+    "Give an example that shows {term} in practice.",
+    "What would change if {term} did not hold?",
+]
+
+
+def material_terms(text, count):
+    """Distinct longer words from the material so generated questions differ from each other"""
+    terms = []
+    for word in re.findall(r"[A-Za-z]{6,}", text):
+        if word.lower() not in terms:
+            terms.append(word.lower())
+    return (terms or ["the key concept"])[:count] or ["the key concept"]
+
+
+def questions_reply(count, sections=0, material=""):
+    terms = material_terms(material, count)
+    pairs = []
+    for i in range(count):
+        term = terms[i % len(terms)]
+        pair = {"Question": QUESTION_TEMPLATES[i % len(QUESTION_TEMPLATES)].format(term=term),
+                "Answer": f"The material explains {term} and how it relates to the surrounding ideas."}
+        if sections:
+            pair["Section"] = i % sections + 1
+        pairs.append(pair)
+    return json.dumps(pairs)
+
+
+def grading_object(rng, index=None):
+    result = {
+        "score": rng.randint(3, 10),
+        "feedback": "The answer covers the main point but could connect it more clearly to the material.",
+        "suggestions": "Mention the specific terms from the material and give an example."
+    }
+    if index is not None:
+        result = {"index": index, **result}
+    return result
+
+
+def build_reply(body, config):
+    """Pick a reply that matches the kind of prompt StudyAI sent"""
+    messages = body.get("messages") or []
+    prompt = message_text(messages[0]) if messages else ""
+    prefill = message_text(messages[-1]) if messages and messages[-1].get("role") == "assistant" else ""
+
+    if config.roll(config.malformed_rate):
+        return "Sure! Here is what you asked for:\n{\"score\": \"eight\", \"feedback\": "
+
+    with config.lock:
+        rng = random.Random(config.random.random())
+    if prefill.startswith("{"):
+        # The grading prompt prefills "{" so the reply continues the object
+        return json.dumps(grading_object(rng))[1:]
+    if "one object per answer" in prompt:
+        count = len(re.findall(r"^\d+\. Question:", prompt, flags=re.MULTILINE))
+        reply = json.dumps([grading_object(rng, i) for i in range(count)])
+        # Batch grading prefills "[" so the reply continues the array
+        return reply[1:] if prefill.startswith("[") else reply
+    requested = re.search(r"generate exactly (\d+)", prompt)
+    if requested:
+        material = system_text(body).split("<study_material>")[-1]
+        sections = len(re.findall(r"^\[Section \d+\]", material, flags=re.MULTILINE))
+        return questions_reply(int(requested.group(1)), sections, material)
+    return "\n".join([
+        "How would you apply this idea to a new example?",
+        "Which assumption in the material is this answer relying on?",
+        "What would change if the key condition did not hold?"
+    ])
+
+
+def prompt_usage(body, config):
+    """Input token usage, emulating the provider prompt cache for system blocks marked with cache_control"""
+    system = body.get("system") or []
+    if isinstance(system, str):
+        system = [{"type": "text", "text": system}]
+    prefix = system_text(body)
+    usage = {
+        "input_tokens": sum(estimate_tokens(message_text(m)) for m in body.get("messages") or []),
+        "cache_creation_input_tokens": 0,
+        "cache_read_input_tokens": 0
+    }
+    if not any("cache_control" in block for block in system):
+        usage["input_tokens"] += estimate_tokens(prefix) if prefix else 0
+        return usage
+    with config.lock:
+        hit = prefix in config.cached_prefixes
+        config.cached_prefixes.add(prefix)
+    usage["cache_read_input_tokens" if hit else "cache_creation_input_tokens"] = estimate_tokens(prefix)
+    return usage
+
+
+def message_payload(body, text, usage):
+    return {
+        "id": "msg_" + uuid.uuid4().hex[:24],
+        "type": "message",
+        "role": "assistant",
+        "model": body.get("model", "mock"),
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {**usage, "output_tokens": estimate_tokens(text)}
+    }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = MockConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.send_json(400, {"type": "error", "error": {"type": "invalid_request_error", "message": "Invalid JSON"}})
+            return
+        if not self.path.rstrip("/").endswith("/v1/messages"):
+            self.send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": "Not found"}})
+            return
+
+        config = self.config
+        with config.lock:
+            config.requests += 1
+        time.sleep(config.first_token_delay())
+        if config.roll(config.error_rate):
+            self.send_json(529, {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}})
+            return
+
+        text = build_reply(body, config)
+        usage = prompt_usage(body, config)
+        if body.get("stream"):
+            self.stream_reply(body, text, usage)
+        else:
+            if config.tokens_per_second > 0:
+                time.sleep(estimate_tokens(text) / config.tokens_per_second)
+            self.send_json(200, message_payload(body, text, usage))
+
+    def send_event(self, event, data):
+        chunk = f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+        self.wfile.flush()
+
+    def stream_reply(self, body, text, usage):
+        message = message_payload(body, "", usage)
+        message["content"] = []
+        message["stop_reason"] = None
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        self.send_event("message_start", {"type": "message_start", "message": message})
+        self.send_event("content_block_start", {"type": "content_block_start", "index": 0,
+                                                "content_block": {"type": "text", "text": ""}})
+        step = CHARS_PER_TOKEN * 4
+        delay = 4 / self.config.tokens_per_second if self.config.tokens_per_second > 0 else 0
+        for start in range(0, len(text), step):
+            if delay:
+                time.sleep(delay)
+            self.send_event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                    "delta": {"type": "text_delta", "text": text[start:start + step]}})
+        self.send_event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        self.send_event("message_delta", {"type": "message_delta",
+                                          "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                          "usage": {"output_tokens": estimate_tokens(text)}})
+        self.send_event("message_stop", {"type": "message_stop"})
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def start_mock_server(port=0, config=None):
+    """Start the mock API on a background thread and return the server"""
+    handler = type("ConfiguredMockHandler", (MockHandler,), {"config": config or MockConfig()})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_mock_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first token (default 0.2)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Random +/- seconds added to the latency")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0, help="Output token rate, 0 for instant")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of replies that are not valid output")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 529 overloaded")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible runs")
+
+
+def config_from_args(args):
+    return MockConfig(latency=args.latency, jitter=args.jitter, tokens_per_second=args.tokens_per_second,
+                      malformed_rate=args.malformed_rate, error_rate=args.error_rate, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Anthropic Messages API for benchmarks")
+    parser.add_argument("--port", type=int, default=8089)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    server = start_mock_server(args.port, config_from_args(args))
+    print(f"Mock LLM listening on http://127.0.0.1:{server.server_address[1]} (set ANTHROPIC_BASE_URL to this)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Content-defined chunking of study material.
+
+Text is split into sentence/line units and a chunk boundary is placed after a
+unit when a hash of that unit alone says so (with a minimum and maximum chunk
+size). Boundaries therefore depend on the surrounding text rather than on
+offsets: editing one paragraph changes the chunk that contains it, and the
+chunks before and after keep their exact text and hash. Joining the chunks
+gives back the original text.
+"""
+import hashlib
+import re
+
+# A sentence or line: text up to ., !, ? or a newline, plus the whitespace after it
+UNIT_PATTERN = re.compile(r"[^.!?\n]*(?:[.!?]+|\n|$)\s*")
+
+MIN_CHUNK_CHARS = 400
+AVG_EXTRA_CHARS = 800
+MAX_CHUNK_CHARS = 3000
+
+
+def split_units(text, max_chars=MAX_CHUNK_CHARS):
+    """Split text into sentence/line units, breaking any unit longer than max_chars on whitespace"""
+    for match in UNIT_PATTERN.finditer(text):
+        unit = match.group(0)
+        while len(unit) > max_chars:
+            cut = unit.rfind(" ", 0, max_chars) + 1 or max_chars
+            yield unit[:cut]
+            unit = unit[cut:]
+        if unit:
+            yield unit
+
+
+def is_boundary(unit, spread):
+    """Cut after this unit with probability len(unit)/spread, decided by the unit's own hash"""
+    digest = hashlib.blake2b(unit.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % spread < len(unit)
+
+
+def content_defined_chunks(text, min_chars=MIN_CHUNK_CHARS, avg_extra_chars=AVG_EXTRA_CHARS,
+                           max_chars=MAX_CHUNK_CHARS):
+    """Split text into chunks of about min_chars + avg_extra_chars whose boundaries follow the content"""
+    chunks = []
+    current = []
+    size = 0
+    for unit in split_units(text, max_chars):
+        if current and size + len(unit) > max_chars:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(unit)
+        size += len(unit)
+        if size >= min_chars and is_boundary(unit, avg_extra_chars):
+            chunks.append("".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("".join(current))
+    return chunks
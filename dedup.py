@@ -0,0 +1,138 @@
+"""MinHash signatures and LSH buckets for spotting near-duplicate questions.
+
+A question is reduced to its key terms: words other than stopwords, generic
+phrasing ("explain", "main idea") and generic process or facet words
+("convert", "stages"), with plural endings stripped. The key terms and their
+adjacent pairs form a shingle set, and a MinHash signature of that set is cut
+into bands. Two questions that share any band bucket are candidates. A
+candidate is a near-duplicate when the Jaccard similarity of the shingle sets
+reaches the threshold, unless the questions differ in a numeral ("I" vs "II")
+or each has a key term the other lacks ("supply" vs "demand"): such a swap
+changes what is asked about. Bucket keys are plain integers, so callers can
+keep them in an indexed SQLite column and look a question up with one query.
+"""
+import hashlib
+import re
+
+from grading import STOPWORDS
+from retrieval import TOKEN_PATTERN
+
+NUM_BANDS = 20
+ROWS_PER_BAND = 3
+NUM_PERMUTATIONS = NUM_BANDS * ROWS_PER_BAND
+MERSENNE_PRIME = (1 << 61) - 1
+DEFAULT_THRESHOLD = 0.8
+
+# Words that change how a question is phrased but not what it asks about
+PHRASING_WORDS = frozenset("""
+according briefly concept describe detail discuss example examples explain give happens idea ideas identify
+important importance key main material mean meaning means name outline purpose role significance state
+summarise summarize
+""".split())
+
+# Process verbs and facet nouns (after plural stripping) that paraphrases swap freely
+GENERIC_WORDS = frozenset("""
+affect allow aspect become change characteristic component contribute convert create element enable factor
+feature form function help impact influence involve kind lead make mechanism part phase process produce
+result stage step transform turn type use way work
+""".split())
+
+NUMERAL_PATTERN = re.compile(r"^(?:\d+|x{0,2}(?:ix|iv|v?i{1,3}|v)|x{1,2})$")
+
+
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+# Fixed (a, b) pairs for the universal hashes h(x) = (a * x + b) mod p standing in for permutations
+PERMUTATIONS = [
+    (_hash64(f"a{i}") % (MERSENNE_PRIME - 1) + 1, _hash64(f"b{i}") % MERSENNE_PRIME)
+    for i in range(NUM_PERMUTATIONS)
+]
+
+
+def stem(word):
+    """Strip a plural ending ("stages" -> "stage"), leaving words like "process" or "mitosis" alone"""
+    if word.endswith("sses"):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def key_terms(text):
+    """Words of a question that say what it is about"""
+    # "i" is a stopword as a pronoun but also a numeral ("World War I"), so it is kept
+    words = [stem(w) for w in TOKEN_PATTERN.findall(text.lower())
+             if (w == "i" or w not in STOPWORDS) and w not in PHRASING_WORDS]
+    return [w for w in words if w not in GENERIC_WORDS]
+
+
+def shingles(text):
+    """Key terms of a question plus adjacent term pairs"""
+    words = key_terms(text)
+    return set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def asks_about_something_else(a, b):
+    """True when the questions' key terms differ in a numeral or one key term is swapped for another"""
+    only_a = set(key_terms(a)) - set(key_terms(b))
+    only_b = set(key_terms(b)) - set(key_terms(a))
+    if any(NUMERAL_PATTERN.match(term) for term in only_a | only_b):
+        return True
+    return bool(only_a) and bool(only_b)
+
+
+def is_near_duplicate(a, b, threshold=DEFAULT_THRESHOLD):
+    """True when two questions ask the same thing in different words.
+
+    >>> is_near_duplicate("What is the main idea of photosynthesis?", "Explain the main idea of photosynthesis.")
+    True
+    >>> is_near_duplicate("Why is the Krebs cycle important?", "What is the significance of the Krebs cycle?")
+    True
+    >>> is_near_duplicate("How do plants convert sunlight into chemical energy?",
+    ...                   "How do plants turn sunlight into chemical energy?")
+    True
+    >>> is_near_duplicate("What are the stages of mitosis?", "What are the phases of mitosis?")
+    True
+    >>> is_near_duplicate("How does supply affect market price?", "How does demand affect market price?")
+    False
+    >>> is_near_duplicate("Describe the causes of World War I.", "Describe the causes of World War II.")
+    False
+    >>> is_near_duplicate("Describe the causes of World War I.", "Describe the effects of World War I.")
+    False
+    >>> is_near_duplicate("Explain the role of mitochondria in a cell.", "Explain the role of chloroplasts in a cell.")
+    False
+    >>> is_near_duplicate("What are the stages of mitosis?", "What are the stages of mitosis in animal cells?")
+    False
+    """
+    if asks_about_something_else(a, b):
+        return False
+    return jaccard(shingles(a), shingles(b)) >= threshold
+
+
+def minhash(shingle_set):
+    """MinHash signature of a shingle set (NUM_PERMUTATIONS values)"""
+    values = [_hash64(shingle) % MERSENNE_PRIME for shingle in shingle_set] or [0]
+    return [min((a * x + b) % MERSENNE_PRIME for x in values) for a, b in PERMUTATIONS]
+
+
+def lsh_buckets(signature):
+    """One signed 64-bit bucket key per band of the signature"""
+    buckets = []
+    for band in range(NUM_BANDS):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(repr((band, rows)).encode("ascii"), digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, "big", signed=True))
+    return buckets
+
+
+def question_buckets(text):
+    """LSH bucket keys for a question's text"""
+    return lsh_buckets(minhash(shingles(text)))
@@ -0,0 +1,198 @@
+"""Content-addressed storage for uploaded study material.
+
+Documents are keyed by the SHA-256 of their text, so uploading the same notes
+twice (or by two students) stores them once. Text is stored as
+content-defined chunks, each keyed by its own hash, plus a per-document list
+of chunk hashes: re-uploading notes after a small edit only writes the chunks
+that changed. The client only ever holds the returned IDs and the server
+assembles prompt context from disk.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from chunking import content_defined_chunks
+
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "documents")
+DOCUMENT_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+CHUNK_DIR = "chunks"
+
+
+class UnknownDocumentError(KeyError):
+    """A document ID that is not (or no longer) in the store"""
+
+
+def hash_content(content):
+    """Return the document ID for a piece of text"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def is_document_id(value):
+    """Check that a client supplied value looks like a document ID"""
+    return isinstance(value, str) and bool(DOCUMENT_ID_PATTERN.match(value))
+
+
+class DocumentStore:
+    """Hash-keyed document store persisted on disk with a small read cache"""
+
+    def __init__(self, root=None, cache_size=32):
+        self.root = root or os.getenv("DOCUMENT_STORE_DIR", DEFAULT_STORE_DIR)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, doc_id, ext):
+        return os.path.join(self.root, doc_id[:2], f"{doc_id}.{ext}")
+
+    def _chunk_path(self, chunk_hash, ext):
+        return os.path.join(self.root, CHUNK_DIR, chunk_hash[:2], f"{chunk_hash}.{ext}")
+
+    def _write_atomic(self, path, text):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def _remember(self, doc_id, content):
+        with self._lock:
+            self._cache[doc_id] = content
+            self._cache.move_to_end(doc_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def put(self, content, filename):
+        """Store content (if new) and return its public metadata plus how many chunks were new.
+
+        Stored metadata is shared by everyone who uploads the same text, so the returned filename is always
+        the caller's own.
+        """
+        doc_id = hash_content(content)
+        metadata = self.get_metadata(doc_id)
+        new_chunks = 0
+        if metadata is None:
+            chunk_hashes = []
+            for chunk in content_defined_chunks(content):
+                chunk_hash = hash_content(chunk)
+                path = self._chunk_path(chunk_hash, "txt")
+                if not os.path.exists(path):
+                    self._write_atomic(path, chunk)
+                    new_chunks += 1
+                chunk_hashes.append(chunk_hash)
+            metadata = {
+                'id': doc_id,
+                'filename': filename,
+                'size': len(content),
+                'chunks': len(chunk_hashes),
+                'uploaded_at': datetime.now().isoformat()
+            }
+            # The chunk list is written before the metadata, which marks the document as stored
+            self.put_sidecar(doc_id, "chunks", chunk_hashes)
+            self._write_atomic(self._path(doc_id, "json"), json.dumps(metadata))
+        self._remember(doc_id, content)
+        return {**metadata, 'filename': filename, 'new_chunks': new_chunks}
+
+    def get_chunk(self, chunk_hash):
+        """Return the text of a stored chunk, or None if unknown"""
+        if not is_document_id(chunk_hash):
+            return None
+        try:
+            with open(self._chunk_path(chunk_hash, "txt"), "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def get_chunks(self, doc_id):
+        """Return a document's (chunk_hash, text) pairs in order, or None if unknown"""
+        chunk_hashes = self.get_sidecar(doc_id, "chunks")
+        if chunk_hashes is None:
+            # Stored before chunking: split the full text the same way
+            content = self.get_content(doc_id)
+            if content is None:
+                return None
+            return [(hash_content(chunk), chunk) for chunk in content_defined_chunks(content)]
+        chunks = []
+        for chunk_hash in chunk_hashes:
+            chunk = self.get_chunk(chunk_hash)
+            if chunk is None:
+                return None
+            chunks.append((chunk_hash, chunk))
+        return chunks
+
+    def get_metadata(self, doc_id):
+        """Return stored metadata for a document, or None if unknown"""
+        if not is_document_id(doc_id):
+            return None
+        try:
+            with open(self._path(doc_id, "json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get_content(self, doc_id):
+        """Return the full text of a document, or None if unknown"""
+        if not is_document_id(doc_id):
+            return None
+        with self._lock:
+            if doc_id in self._cache:
+                self._cache.move_to_end(doc_id)
+                return self._cache[doc_id]
+        try:
+            with open(self._path(doc_id, "txt"), "r", encoding="utf-8") as f:
+                content = f.read()
+        except OSError:
+            if self.get_sidecar(doc_id, "chunks") is None:
+                return None
+            chunks = self.get_chunks(doc_id)
+            if chunks is None:
+                return None
+            content = "".join(chunk for _, chunk in chunks)
+        self._remember(doc_id, content)
+        return content
+
+    def assemble(self, doc_ids):
+        """Join the text of several documents into one study context"""
+        parts = []
+        for doc_id in doc_ids:
+            content = self.get_content(doc_id)
+            if content is None:
+                raise UnknownDocumentError(f"Unknown document: {doc_id}")
+            parts.append(content)
+        return "\n\n".join(parts)
+
+    def put_sidecar(self, doc_id, name, data):
+        """Persist derived JSON data (e.g. a retrieval index) next to a document"""
+        if not is_document_id(doc_id):
+            raise UnknownDocumentError(f"Unknown document: {doc_id}")
+        self._write_atomic(self._path(doc_id, f"{name}.json"), json.dumps(data))
+
+    def get_sidecar(self, doc_id, name):
+        """Load derived JSON data stored with put_sidecar(), or None"""
+        if not is_document_id(doc_id):
+            return None
+        try:
+            with open(self._path(doc_id, f"{name}.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put_chunk_sidecar(self, chunk_hash, name, data):
+        """Persist derived JSON data (e.g. term frequencies) for one chunk"""
+        if not is_document_id(chunk_hash):
+            raise KeyError(f"Unknown chunk: {chunk_hash}")
+        self._write_atomic(self._chunk_path(chunk_hash, f"{name}.json"), json.dumps(data))
+
+    def get_chunk_sidecar(self, chunk_hash, name):
+        """Load derived JSON data stored with put_chunk_sidecar(), or None"""
+        if not is_document_id(chunk_hash):
+            return None
+        try:
+            with open(self._chunk_path(chunk_hash, f"{name}.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
@@ -0,0 +1,216 @@
+"""Structured grading prompt, response validation and the local fallback grader.
+
+The LLM is asked for one JSON object (score first, so a streaming client can
+show it early). Replies are validated leniently; anything unusable is graded
+by local_grade_answer(), which costs no tokens.
+"""
+import json
+import re
+
+GRADING_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "score": {"type": "integer", "minimum": 0, "maximum": 10},
+        "feedback": {"type": "string"},
+        "suggestions": {"type": "string"}
+    },
+    "required": ["score", "feedback", "suggestions"]
+}
+
+GRADING_INSTRUCTIONS = (
+    "Grade the student's answer out of 10 as if you were their professor, with 0 being fail and 10 being above and beyond. "
+    "Respond with ONLY a JSON object matching this schema, keys in this order, no markdown and no text outside the JSON: "
+    + json.dumps(GRADING_SCHEMA)
+)
+
+UNCERTAIN_PHRASES = ("i don't know", "i dont know", "not sure", "no idea", "maybe")
+
+STOPWORDS = frozenset("""
+a an and are as at be been but by can could did do does for from had has have how i if in into is it its
+me my no not of on or our so than that the their them then there these they this to too was we were what
+when where which while who why will with would you your
+""".split())
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def build_grading_prompt(question, answer):
+    """Build the single grading request for one answer (the material is sent as the shared prefix)"""
+    return (
+        "Question: " + question
+        + "\n\nStudent answer: " + answer
+        + "\n\n" + GRADING_INSTRUCTIONS
+    )
+
+
+def clamp_score(value):
+    """Coerce a score from int/float/"8/10" style values into 0-10"""
+    if isinstance(value, bool):
+        raise ValueError("Score must be a number")
+    if isinstance(value, (int, float)):
+        number = value
+    else:
+        match = re.search(r"\d+(?:\.\d+)?", str(value))
+        if not match:
+            raise ValueError(f"No score in {value!r}")
+        number = float(match.group())
+    return max(0, min(10, int(round(number))))
+
+
+def _extract_json_object(text):
+    start = text.find("{")
+    end = text.rfind("}")
+    if start == -1 or end <= start:
+        raise ValueError("No JSON object in grading response")
+    return json.loads(text[start:end + 1])
+
+
+def _parse_line_format(text):
+    lines = [line.strip() for line in text.strip().split("\n") if line.strip()]
+    if not lines:
+        raise ValueError("Empty grading response")
+    return {
+        "score": clamp_score(lines[0]),
+        "feedback": " ".join(lines[1:-1]).strip(),
+        "suggestions": lines[-1] if len(lines) > 1 else ""
+    }
+
+
+def parse_grading_response(text):
+    """Validate an LLM grading reply; raises ValueError if it is unusable"""
+    try:
+        data = _extract_json_object(text)
+    except ValueError:
+        # Tolerate the older "score / feedback / suggestions" line format
+        return _parse_line_format(text)
+    if not isinstance(data, dict) or "score" not in data:
+        raise ValueError("Grading response has no score")
+    return {
+        "score": clamp_score(data["score"]),
+        "feedback": str(data.get("feedback") or "").strip(),
+        "suggestions": str(data.get("suggestions") or "").strip()
+    }
+
+
+SCORE_PATTERN = re.compile(r'"score"\s*:\s*"?(\d+(?:\.\d+)?)')
+
+
+def partial_score(text):
+    """Return the score from a partially streamed JSON reply, or None if not there yet"""
+    match = SCORE_PATTERN.search(text)
+    if not match:
+        return None
+    # Wait for the token after the number so "1" is not mistaken for "10"
+    if match.end() == len(text):
+        return None
+    return clamp_score(match.group(1))
+
+
+def partial_string_field(text, key):
+    """Return the decoded prefix of a string field in a partially streamed JSON reply"""
+    match = re.search(r'"' + re.escape(key) + r'"\s*:\s*"', text)
+    if not match:
+        return ""
+    raw = text[match.end():]
+    end = re.search(r'(?<!\\)(?:\\\\)*"', raw)
+    if end:
+        raw = raw[:end.end() - 1]
+    # Drop an escape sequence that has not fully arrived yet
+    raw = re.sub(r'\\(u[0-9a-fA-F]{0,3})?$', '', raw)
+    try:
+        return json.loads('"' + raw + '"')
+    except ValueError:
+        return ""
+
+
+def _keywords(text):
+    return {w for w in WORD_PATTERN.findall(text.lower()) if w not in STOPWORDS and len(w) > 2}
+
+
+def local_grade_answer(question, answer, reference=""):
+    """Zero-cost grader: keyword overlap with the reference answer (or study material)"""
+    answer_words = _keywords(answer)
+    lowered = answer.lower()
+
+    if len(answer.strip()) < 20 or not answer_words:
+        return {
+            "score": 3,
+            "feedback": "Your answer is too brief. Please provide more detail.",
+            "suggestions": "Expand your answer with specific examples and explanations."
+        }
+    if any(phrase in lowered for phrase in UNCERTAIN_PHRASES) and len(answer_words) < 8:
+        return {
+            "score": 4,
+            "feedback": "It's okay to be uncertain, but try to apply what you know.",
+            "suggestions": "Use the study material to form a more confident answer."
+        }
+
+    target_words = _keywords(reference) | _keywords(question)
+    if not target_words:
+        coverage = 0.5
+    else:
+        # Recall against the reference, capped so long study material is not required verbatim
+        coverage = len(answer_words & target_words) / min(len(target_words), 25)
+    detail = min(len(answer_words) / 30, 1.0)
+    score = clamp_score(2 + 6 * min(coverage, 1.0) + 2 * detail)
+
+    missing = sorted(target_words - answer_words, key=len, reverse=True)[:3]
+    if score >= 8:
+        feedback = "Excellent detailed answer! You've shown good understanding."
+        suggestions = "Keep up the great work with detailed explanations!"
+    elif score >= 6:
+        feedback = "Good attempt! Your answer shows understanding of the topic."
+        suggestions = "Try to provide more specific examples and details."
+    else:
+        feedback = "Your answer misses several key ideas from the material."
+        suggestions = "Review the study material and include the main concepts in your answer."
+    if missing and score < 8:
+        suggestions += " Consider covering: " + ", ".join(missing) + "."
+    return {"score": score, "feedback": feedback, "suggestions": suggestions}
+
+
+BATCH_GRADING_INSTRUCTIONS = (
+    "Grade each numbered student answer out of 10 as if you were their professor, with 0 being fail and 10 being above and beyond. "
+    "Respond with ONLY a JSON array containing one object per answer, in order, each matching this schema plus an integer "
+    "\"index\" key, no markdown and no text outside the JSON: "
+    + json.dumps(GRADING_SCHEMA)
+)
+
+
+def build_batch_grading_prompt(items):
+    """Build one grading request for several (question, answer) pairs sharing the same material"""
+    parts = []
+    for index, item in enumerate(items):
+        parts.append(f"{index}. Question: {item['question']}\n{index}. Student answer: {item['answer']}")
+    parts.append(BATCH_GRADING_INSTRUCTIONS)
+    return "\n\n".join(parts)
+
+
+def parse_batch_grading_response(text, count):
+    """Validate a batch grading reply; returns one result (or None if unusable) per item"""
+    start = text.find("[")
+    end = text.rfind("]")
+    results = [None] * count
+    if start == -1 or end <= start:
+        return results
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return results
+    if not isinstance(data, list):
+        return results
+    for position, entry in enumerate(data):
+        if not isinstance(entry, dict) or "score" not in entry:
+            continue
+        index = entry.get("index", position)
+        if not isinstance(index, int) or not 0 <= index < count:
+            continue
+        try:
+            results[index] = {
+                "score": clamp_score(entry["score"]),
+                "feedback": str(entry.get("feedback") or "").strip(),
+                "suggestions": str(entry.get("suggestions") or "").strip()
+            }
+        except ValueError:
+            continue
+    return results
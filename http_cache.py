@@ -0,0 +1,159 @@
+"""Response compression, validators and pre-rendered pages.
+
+Text and JSON responses above COMPRESS_MIN_BYTES are compressed with brotli
+(when the optional brotli package is installed) or gzip, whichever the client
+accepts. Pages without per-request context are rendered once and kept
+together with their compressed variants, so serving them is a dictionary
+lookup. Listing endpoints get an ETag (and a Last-Modified when known) and
+answer 304 when the client's copy is still current.
+"""
+import gzip
+import hashlib
+import os
+import threading
+from datetime import datetime
+
+from metrics import registry
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "image/svg+xml")
+
+http_compression_bytes = registry.counter(
+    "studyai_http_compression_bytes_total", "Response bytes before and after compression", ("encoding", "stage"))
+
+
+def accepted_encodings(accept_encoding):
+    """Encodings the client accepts (q > 0) from an Accept-Encoding header"""
+    accepted = set()
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if name:
+            accepted.add(name.strip())
+    return accepted
+
+
+def choose_encoding(accept_encoding):
+    """Pick brotli or gzip for a client, or None to send the body as is"""
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def is_compressible(response):
+    return (response.status_code == 200
+            and not response.direct_passthrough
+            and not response.is_streamed
+            and "Content-Encoding" not in response.headers
+            and (response.mimetype or "").startswith(COMPRESSIBLE_TYPES))
+
+
+def compress_response(response, accept_encoding):
+    """Compress a finished response in place when it is large enough and the client accepts it"""
+    if not is_compressible(response):
+        return response
+    response.vary.add("Accept-Encoding")
+    body = response.get_data()
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None or len(body) < COMPRESS_MIN_BYTES:
+        return response
+    compressed = compress(body, encoding)
+    http_compression_bytes.inc(len(body), encoding=encoding, stage="original")
+    http_compression_bytes.inc(len(compressed), encoding=encoding, stage="sent")
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def conditional_response(response, request, last_modified=None):
+    """Add a weak ETag (and Last-Modified) to a response and turn it into a 304 if the client is current"""
+    response.add_etag(weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Clients may keep the body but must revalidate before using it
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def parse_timestamp(value):
+    """Parse a stored ISO timestamp for Last-Modified, or None"""
+    try:
+        return datetime.fromisoformat(value).astimezone() if value else None
+    except ValueError:
+        return None
+
+
+class RenderedPage:
+    def __init__(self, body, mtime):
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.last_modified = datetime.fromtimestamp(int(mtime)).astimezone()
+        self.mtime = mtime
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding):
+        """Body compressed with encoding, compressed once and then reused"""
+        with self._lock:
+            if encoding not in self._encoded:
+                self._encoded[encoding] = compress(self.body, encoding)
+            return self._encoded[encoding]
+
+
+class StaticPages:
+    """Templates rendered once per process and re-rendered only when the file changes"""
+
+    def __init__(self, render, template_folder):
+        self.render = render
+        self.template_folder = template_folder
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        mtime = os.path.getmtime(os.path.join(self.template_folder, name))
+        page = self._pages.get(name)
+        if page is None or page.mtime != mtime:
+            page = RenderedPage(self.render(name).encode("utf-8"), mtime)
+            with self._lock:
+                self._pages[name] = page
+        return page
+
+    def response(self, name, request, response_class):
+        """A conditional, pre-compressed response for a static template"""
+        page = self.get(name)
+        response = response_class(page.body, mimetype="text/html")
+        response.set_etag(page.etag, weak=True)
+        response.last_modified = page.last_modified
+        response.cache_control.no_cache = True
+        response.vary.add("Accept-Encoding")
+        response = response.make_conditional(request)
+        encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+        if response.status_code == 200 and encoding and len(page.body) >= COMPRESS_MIN_BYTES:
+            body = page.encoded(encoding)
+            http_compression_bytes.inc(len(page.body), encoding=encoding, stage="original")
+            http_compression_bytes.inc(len(body), encoding=encoding, stage="sent")
+            response.set_data(body)
+            response.headers["Content-Encoding"] = encoding
+        return response
@@ -0,0 +1,180 @@
+"""Streaming upload ingestion: bounded spooling, type detection and text extraction.
+
+The multipart parser writes each uploaded file straight into a temporary file
+that rejects it as soon as it exceeds the size limit, while it is still being
+received. Text is then extracted incrementally
+(page by page for PDF, element by element for DOCX, chunk by chunk for plain
+text) and the temporary file is always removed afterwards.
+"""
+import codecs
+import os
+import tempfile
+import zipfile
+import xml.etree.ElementTree as ET
+
+READ_CHUNK_BYTES = 64 * 1024
+HEAD_BYTES = 8
+
+DOCX_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+class UploadError(ValueError):
+    """Raised when an uploaded file cannot be ingested"""
+
+
+class UploadTooLargeError(UploadError):
+    """Raised when an upload exceeds the configured size limit"""
+
+
+class SpooledUpload:
+    """An upload copied to a temporary file, plus the bytes needed to detect its type"""
+
+    def __init__(self, path, size, head):
+        self.path = path
+        self.size = size
+        self.head = head
+
+    def cleanup(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class BoundedUploadFile:
+    """Temporary file receiving one uploaded file, enforcing max_bytes as it is written.
+
+    Meant as the multipart parser's file container: the file lands on disk once, and an oversized one
+    is removed and too_large is raised before the rest of it is read.
+    """
+
+    def __init__(self, max_bytes, too_large=UploadTooLargeError):
+        fd, self.path = tempfile.mkstemp(prefix="studyai_upload_")
+        self._file = os.fdopen(fd, "w+b")
+        self.max_bytes = max_bytes
+        self.too_large = too_large
+        self.size = 0
+        self.head = b""
+        self.claimed = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.discard()
+            raise self.too_large(f"File exceeds the {self.max_bytes / (1024 * 1024):.1f} MB upload limit")
+        if len(self.head) < HEAD_BYTES:
+            self.head += data[:HEAD_BYTES - len(self.head)]
+        return self._file.write(data)
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readline(self, size=-1):
+        return self._file.readline(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def finish(self):
+        """Hand the received file over as a SpooledUpload, whose cleanup() then removes it"""
+        self._file.close()
+        self.claimed = True
+        return SpooledUpload(self.path, self.size, self.head)
+
+    def discard(self):
+        """Close the file and remove it unless it was handed over"""
+        self._file.close()
+        if not self.claimed:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def detect_file_type(filename, head):
+    """Detect the document type from its magic bytes, falling back to the extension"""
+    extension = os.path.splitext(filename or "")[1].lower()
+    if head.startswith(b"%PDF"):
+        return "pdf"
+    if head.startswith(b"PK\x03\x04"):
+        return "docx" if extension in ("", ".docx") else "zip"
+    if head.startswith(b"\xd0\xcf\x11\xe0"):
+        return "doc"
+    return "txt"
+
+
+def iter_text_chunks(path):
+    """Decode a text file incrementally as UTF-8, switching to latin-1 if it is not UTF-8"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(READ_CHUNK_BYTES)
+            final = not chunk
+            try:
+                yield decoder.decode(chunk, final=final)
+            except UnicodeDecodeError:
+                pending = decoder.getstate()[0]
+                decoder = codecs.getincrementaldecoder("latin-1")()
+                yield decoder.decode(pending + chunk, final=final)
+            if final:
+                break
+
+
+def iter_pdf_pages(path):
+    """Extract PDF text one page at a time (requires the optional pypdf package)"""
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise UploadError("PDF support requires the 'pypdf' package (pip install pypdf)")
+    try:
+        reader = PdfReader(path)
+        for page in reader.pages:
+            yield (page.extract_text() or "") + "\n\n"
+    except UploadError:
+        raise
+    except Exception as e:
+        raise UploadError(f"Could not read PDF: {e}")
+
+
+def iter_docx_paragraphs(path):
+    """Stream paragraphs out of word/document.xml without loading the whole tree"""
+    try:
+        with zipfile.ZipFile(path) as archive:
+            with archive.open("word/document.xml") as document:
+                parts = []
+                for event, element in ET.iterparse(document, events=("end",)):
+                    if element.tag == DOCX_NAMESPACE + "t":
+                        parts.append(element.text or "")
+                    elif element.tag == DOCX_NAMESPACE + "tab":
+                        parts.append("\t")
+                    elif element.tag == DOCX_NAMESPACE + "p":
+                        yield "".join(parts) + "\n"
+                        parts = []
+                        element.clear()
+    except (KeyError, zipfile.BadZipFile, ET.ParseError) as e:
+        raise UploadError(f"Could not read DOCX: {e}")
+
+
+def extract_text(upload, filename):
+    """Return the text of a spooled upload"""
+    file_type = detect_file_type(filename, upload.head)
+    if file_type == "pdf":
+        parts = iter_pdf_pages(upload.path)
+    elif file_type == "docx":
+        parts = iter_docx_paragraphs(upload.path)
+    elif file_type == "txt":
+        parts = iter_text_chunks(upload.path)
+    elif file_type == "doc":
+        raise UploadError("Legacy .doc files are not supported, please save as .docx or PDF")
+    else:
+        raise UploadError("Unsupported file type")
+    return "".join(parts).strip()
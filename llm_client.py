@@ -0,0 +1,215 @@
+"""Process-wide Anthropic client shared by every LLM call path.
+
+The client (and its keep-alive HTTP connection pool) is built lazily on first
+use and then reused, instead of opening new connections on every request.
+Every call is admitted by the shared rate limiter (llm_scheduler) first, and a
+429 pauses all callers before the request is retried.
+"""
+import logging
+import os
+import threading
+import time
+
+import anthropic
+import httpx
+
+from llm_scheduler import build_rate_limiter, estimate_request_tokens
+from metrics import llm_calls, record_llm_usage, stage
+
+logger = logging.getLogger(__name__)
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return float(default)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return int(default)
+
+
+def retry_after_seconds(error, default=5.0):
+    """Seconds to back off after a 429, from its retry-after header when present"""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+class SchedulerAwareAnthropic(anthropic.Anthropic):
+    """Anthropic client whose built-in retries skip 429s, which the rate limiter handles for every caller"""
+
+    def _should_retry(self, response):
+        if response.status_code == 429:
+            return False
+        return super()._should_retry(response)
+
+
+class LLMUnavailableError(RuntimeError):
+    """Raised when an LLM call is attempted without a configured client"""
+
+
+class LLMClientProvider:
+    """Lazily initialised, thread-safe holder for a single Anthropic client"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rate_limiter = build_rate_limiter()
+        self.rate_limit_retries = _env_int("LLM_RATE_LIMIT_RETRIES", 3)
+        self._client = None
+        self._initialised = False
+        self.healthy = False
+        self.last_error = None
+        # After a connection/auth failure calls are skipped until this time; the next call then decides health again
+        self.retry_unhealthy_after = _env_float("LLM_UNHEALTHY_RETRY", 30)
+        self._retry_at = 0.0
+
+    def _build_client(self):
+        api_key = os.getenv("ANTHROPIC_API_KEY")
+        if not api_key:
+            logger.warning("ANTHROPIC_API_KEY not found. LLM Integration: DISABLED (Fallback mode)")
+            return None
+
+        timeout = httpx.Timeout(
+            _env_float("LLM_TIMEOUT", 60),
+            connect=_env_float("LLM_CONNECT_TIMEOUT", 10)
+        )
+        limits = httpx.Limits(
+            max_connections=_env_int("LLM_MAX_CONNECTIONS", 100),
+            max_keepalive_connections=_env_int("LLM_MAX_KEEPALIVE", 20),
+            keepalive_expiry=_env_float("LLM_KEEPALIVE_EXPIRY", 30)
+        )
+        try:
+            client = SchedulerAwareAnthropic(
+                api_key=api_key,
+                base_url=os.getenv("ANTHROPIC_BASE_URL") or None,
+                timeout=timeout,
+                max_retries=_env_int("LLM_MAX_RETRIES", 2),
+                http_client=httpx.Client(timeout=timeout, limits=limits)
+            )
+        except Exception as e:
+            self.last_error = str(e)
+            logger.warning("LLM not available: %s. LLM Integration: DISABLED (Fallback mode)", e)
+            return None
+
+        logger.info("AI Integration: ENABLED (Anthropic Claude AI)")
+        return client
+
+    def get_client(self):
+        """Return the shared client, building it on first use"""
+        if not self._initialised:
+            with self._lock:
+                if not self._initialised:
+                    self._client = self._build_client()
+                    self.healthy = self._client is not None
+                    self._initialised = True
+        return self._client
+
+    def is_available(self):
+        """True when a client is configured and the last call did not fail (or its retry delay has passed)"""
+        if self.get_client() is None:
+            return False
+        return self.healthy or time.monotonic() >= self._retry_at
+
+    def mark_healthy(self):
+        self.healthy = True
+        self.last_error = None
+
+    def mark_unhealthy(self, error):
+        self.healthy = False
+        self.last_error = str(error)
+        self._retry_at = time.monotonic() + self.retry_unhealthy_after
+
+    def _handle_error(self, model, error):
+        llm_calls.inc(model=model, outcome="error")
+        if isinstance(error, (anthropic.APIConnectionError, anthropic.AuthenticationError)):
+            self.mark_unhealthy(error)
+
+    def _rate_limited(self, model, error, attempt):
+        """Pause all callers after a 429; returns True if the request should be retried"""
+        llm_calls.inc(model=model, outcome="rate_limited")
+        self.rate_limiter.backoff(retry_after_seconds(error))
+        return attempt < self.rate_limit_retries
+
+    def create_message(self, **kwargs):
+        """Send a Messages API request through the shared client"""
+        client = self.get_client()
+        if client is None:
+            raise LLMUnavailableError("LLM client is not configured")
+        model = kwargs.get("model", "")
+        tokens = estimate_request_tokens(kwargs)
+        attempt = 0
+        while True:
+            reservation = self.rate_limiter.acquire(tokens)
+            try:
+                with stage("llm_call"):
+                    message = client.messages.create(**kwargs)
+                break
+            except anthropic.RateLimitError as e:
+                self.rate_limiter.settle(reservation, None)
+                if not self._rate_limited(model, e, attempt):
+                    raise
+                attempt += 1
+            except Exception as e:
+                self.rate_limiter.settle(reservation, None)
+                self._handle_error(model, e)
+                raise
+        usage = getattr(message, "usage", None)
+        self.rate_limiter.settle(reservation, usage)
+        llm_calls.inc(model=model, outcome="success")
+        record_llm_usage(model, usage)
+        self.mark_healthy()
+        return message
+
+    def stream_text(self, **kwargs):
+        """Stream a Messages API request, yielding text deltas as they arrive"""
+        client = self.get_client()
+        if client is None:
+            raise LLMUnavailableError("LLM client is not configured")
+        model = kwargs.get("model", "")
+        tokens = estimate_request_tokens(kwargs)
+        attempt = 0
+        while True:
+            reservation = self.rate_limiter.acquire(tokens)
+            started = False
+            try:
+                with stage("llm_stream"):
+                    with client.messages.stream(**kwargs) as stream:
+                        for text in stream.text_stream:
+                            started = True
+                            yield text
+                        usage = getattr(stream.get_final_message(), "usage", None)
+                break
+            except anthropic.RateLimitError as e:
+                self.rate_limiter.settle(reservation, None)
+                # Text already sent to the client cannot be taken back, so only retry before the first delta
+                if started or not self._rate_limited(model, e, attempt):
+                    raise
+                attempt += 1
+            except Exception as e:
+                self.rate_limiter.settle(reservation, None)
+                self._handle_error(model, e)
+                raise
+        self.rate_limiter.settle(reservation, usage)
+        llm_calls.inc(model=model, outcome="success")
+        record_llm_usage(model, usage)
+        self.mark_healthy()
+
+    def reset(self):
+        """Drop the current client so the next call rebuilds it (e.g. after a key change)"""
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+            self._client = None
+            self._initialised = False
+            self.healthy = False
+
+
+llm_provider = LLMClientProvider()
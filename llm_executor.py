@@ -0,0 +1,161 @@
+"""Bounded worker pool that runs slow work off the Flask request threads.
+
+LLM calls and text extraction from large uploads run here. Routes either
+wait for a task with a per-request timeout, or queue it as a job and return
+immediately so the client can poll for the result. The pool caps how many LLM
+calls are in flight and how many may wait in the queue, so a burst of grading
+requests can never exhaust the threads that serve fast endpoints like
+/analytics.
+"""
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+
+class ExecutorBusyError(RuntimeError):
+    """Raised when the LLM queue is full"""
+
+
+class LLMTimeoutError(TimeoutError):
+    """Raised when an LLM task does not finish within its timeout"""
+
+
+class LLMExecutor:
+    """Thread pool with a bounded queue, per-task timeouts and pollable jobs"""
+
+    def __init__(self, max_workers=32, max_pending=256, default_timeout=60, max_jobs=1000, job_ttl=600):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.default_timeout = default_timeout
+        self.max_jobs = max_jobs
+        self.job_ttl = job_ttl
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-worker")
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._jobs = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        self._in_flight = 0
+        self._counter_lock = threading.Lock()
+
+    def _run_with_slot(self, fn, args, kwargs):
+        with self._counter_lock:
+            self._in_flight += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._counter_lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn on the pool and return its Future"""
+        if not self._slots.acquire(blocking=False):
+            raise ExecutorBusyError("Too many LLM requests in progress, please retry shortly")
+        try:
+            return self._pool.submit(self._run_with_slot, fn, args, kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def run(self, fn, *args, timeout=None, **kwargs):
+        """Run fn on the pool and wait for its result up to timeout seconds"""
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            return future.result(timeout=timeout or self.default_timeout)
+        except FutureTimeoutError:
+            raise LLMTimeoutError("LLM request timed out")
+
+    def stream(self, events, timeout=None):
+        """Iterate the generator events on the pool and return an iterator over its items.
+
+        The stream takes a slot like any other task, so a full queue raises ExecutorBusyError here
+        rather than once the response has started. The returned iterator raises LLMTimeoutError if no
+        item arrives within timeout seconds; closing it stops the producer after its current item.
+        """
+        items = queue.Queue()
+        closed = threading.Event()
+        done = object()
+
+        def produce():
+            try:
+                for item in events:
+                    if closed.is_set():
+                        break
+                    items.put((item, None))
+            except Exception as e:
+                items.put((done, e))
+            finally:
+                events.close()
+                items.put((done, None))
+
+        def consume():
+            try:
+                while True:
+                    try:
+                        item, error = items.get(timeout=timeout or self.default_timeout)
+                    except queue.Empty:
+                        raise LLMTimeoutError("LLM request timed out")
+                    if error is not None:
+                        raise error
+                    if item is done:
+                        return
+                    yield item
+            finally:
+                closed.set()
+
+        self.submit(produce)
+        return consume()
+
+    def _prune_jobs(self):
+        cutoff = time.time() - self.job_ttl
+        while self._jobs:
+            job_id, job = next(iter(self._jobs.items()))
+            if len(self._jobs) <= self.max_jobs and not (job['future'].done() and job['created_at'] < cutoff):
+                break
+            self._jobs.popitem(last=False)
+
+    def submit_job(self, fn, *args, **kwargs):
+        """Queue fn as a pollable job and return its ID"""
+        future = self.submit(fn, *args, **kwargs)
+        job_id = uuid.uuid4().hex
+        with self._jobs_lock:
+            self._jobs[job_id] = {'future': future, 'created_at': time.time()}
+            self._prune_jobs()
+        return job_id
+
+    def job_status(self, job_id):
+        """Return the state of a job, or None if it is unknown or expired"""
+        with self._jobs_lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        future = job['future']
+        if not future.done():
+            return {'status': 'running' if future.running() else 'queued'}
+        error = future.exception()
+        if error is not None:
+            return {'status': 'failed', 'error': str(error)}
+        return {'status': 'done', 'result': future.result()}
+
+    def stats(self):
+        return {
+            'max_workers': self.max_workers,
+            'max_pending': self.max_pending,
+            'in_flight': self._in_flight,
+            'jobs': len(self._jobs)
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+
+def build_llm_executor():
+    """Create the executor configured by LLM_WORKERS / LLM_MAX_PENDING / LLM_REQUEST_TIMEOUT"""
+    return LLMExecutor(
+        max_workers=int(os.getenv("LLM_WORKERS", "32")),
+        max_pending=int(os.getenv("LLM_MAX_PENDING", "256")),
+        default_timeout=float(os.getenv("LLM_REQUEST_TIMEOUT", "60"))
+    )
@@ -1,42 +1,143 @@
-# Steps
-# Receive Text from client, process and save + Agents
-# client wants info from us - generating information from us
+"""Offline question-bank builder.
+
+Walks a directory of course material (TXT, PDF, DOCX), splits each document
+into chunks and generates question/answer pairs for every chunk in parallel.
+Finished chunks are checkpointed in the bank, so re-running the command after
+an interruption only does the remaining work. The app serves
+/generate_questions from the bank for any uploaded document whose text
+matches a banked one, without a live LLM call.
+
+    python llm_integration.py course_material/ --concurrency 8
+
+The API key is read from ANTHROPIC_API_KEY (or .env), never from source.
+"""
+import argparse
 import os
-import anthropic
-import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+# Modules below read their settings at import time, so .env has to be loaded first
+load_dotenv()
+
+from document_store import hash_content
+from ingestion import HEAD_BYTES, SpooledUpload, UploadError, extract_text
+from llm_client import llm_provider
+from llm_scheduler import BULK, lane
+from prompts import study_request
+from question_bank import BANK_PROMPT, QuestionBank, parse_question_pairs
+from retrieval import CHARS_PER_TOKEN, chunk_text
+from routing import route
+
+DEFAULT_MODEL = route("questions").model
+SUPPORTED_EXTENSIONS = (".txt", ".md", ".pdf", ".docx")
+
+
+def find_documents(root, extensions=SUPPORTED_EXTENSIONS):
+    """Yield course material files under root in a stable order"""
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(extensions):
+                yield os.path.join(directory, filename)
+
 
-def read_file_as_string(filename: str) -> str:
-    try:
-        with open(filename, "r", encoding="utf-8") as file:
-            content = file.read()
-        return content
-    except FileNotFoundError:
-        return f"Error: File '{filename}' not found."
-    except Exception as e:
-        return f"Error reading file: {e}"
+def read_document(path):
+    """Extract text exactly as an upload of the same file would"""
+    with open(path, "rb") as f:
+        head = f.read(HEAD_BYTES)
+    upload = SpooledUpload(path, os.path.getsize(path), head)
+    return extract_text(upload, os.path.basename(path))
+
+
+def generate_chunk_questions(chunk, count, model, retries=2):
+    """Ask the LLM for count question/answer pairs about one chunk"""
+    prompt = BANK_PROMPT.format(count=count)
+    for attempt in range(retries + 1):
+        try:
+            with lane(BULK):
+                message = llm_provider.create_message(
+                    model=model,
+                    max_tokens=2048,
+                    **study_request(chunk, prompt, model=model)
+                )
+            return parse_question_pairs(message.content[0].text.strip())
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(2 ** attempt)
+
+
+def build_bank(root, bank, concurrency=4, questions_per_chunk=5, chunk_tokens=1500, model=DEFAULT_MODEL):
+    """Generate questions for every chunk not already checkpointed in the bank"""
+    tasks = []
+    for path in find_documents(root):
+        try:
+            text = read_document(path)
+        except UploadError as e:
+            print(f"Skipping {path}: {e}")
+            continue
+        if not text:
+            continue
+        document_id = hash_content(text)
+        chunks = chunk_text(text, chunk_chars=chunk_tokens * CHARS_PER_TOKEN, overlap_chars=0)
+        bank.register_document(document_id, os.path.relpath(path, root), len(chunks))
+        done = bank.completed_chunks(document_id)
+        pending = [(document_id, index, chunk) for index, chunk in enumerate(chunks) if index not in done]
+        print(f"{path}: {len(chunks)} chunks, {len(pending)} to generate")
+        tasks.extend(pending)
+
+    if not tasks:
+        print("Question bank is up to date")
+        return 0
+
+    failures = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {
+            pool.submit(generate_chunk_questions, chunk, questions_per_chunk, model): (document_id, index)
+            for document_id, index, chunk in tasks
+        }
+        for completed, future in enumerate(as_completed(futures), start=1):
+            document_id, index = futures[future]
+            try:
+                bank.save_chunk(document_id, index, future.result())
+            except Exception as e:
+                failures += 1
+                bank.mark_failed(document_id, index, e)
+                print(f"Chunk {index} of {document_id[:12]} failed: {e}")
+            if completed % 10 == 0 or completed == len(futures):
+                print(f"{completed}/{len(futures)} chunks processed")
+    return failures
 
 
 def main():
-    sample_text = read_file_as_string("software_engineer_journal (1).txt")
-
-    CEREBRAS_API_KEY = "csk-vfvcffc9wvekh45e4exhf6hpdwd3pwc324v4mc59prnykwwr"
-    # Send to LLM to reformat and save text
-    client = anthropic.Anthropic(
-    # defaults to os.environ.get("ANTHROPIC_API_KEY")
-        api_key="sk-ant-REDACTED",
-    )
-    message = client.messages.create(
-        model="claude-opus-4-1-20250805",
-        max_tokens=1024,
-        messages=[
-            {"role": "user", "content": "based on " + sample_text + "give me 3 questions that I have to answer in a python list of string type format. return only a list of text",}
-        ]
-    )
-    output = message.content[0].text.strip()
-    print(output)
-
-    
+    parser = argparse.ArgumentParser(description="Build a question bank from a directory of course material")
+    parser.add_argument("directory", help="Directory of TXT/MD/PDF/DOCX course material")
+    parser.add_argument("--bank", help="Question bank file (default QUESTION_BANK_PATH or data/question_bank.db)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Parallel LLM requests (default 4)")
+    parser.add_argument("--questions-per-chunk", type=int, default=5, help="Questions generated per chunk (default 5)")
+    parser.add_argument("--chunk-tokens", type=int, default=1500, help="Approximate chunk size in tokens (default 1500)")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        parser.error(f"{args.directory} is not a directory")
+    if llm_provider.get_client() is None:
+        print("ANTHROPIC_API_KEY is not set", file=sys.stderr)
+        return 2
+
+    bank = QuestionBank(args.bank)
+    failures = build_bank(args.directory, bank, args.concurrency, args.questions_per_chunk,
+                          args.chunk_tokens, args.model)
+    stats = bank.stats()
+    print(f"Bank has {stats['questions']} questions for {stats['documents']} documents")
+    if failures:
+        print(f"{failures} chunks failed, re-run to retry them", file=sys.stderr)
+        return 1
+    return 0
+
 
 if __name__ == "__main__":
-    main()
-# client wants info from us - generating information from us
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""Process-wide admission control for outbound LLM requests.
+
+Every Messages API call first reserves one request and its estimated tokens
+from per-minute token buckets (LLM_RPM, LLM_TPM). Callers that cannot be
+admitted yet wait in priority lanes: interactive requests (a student waiting
+on a grade) always go before background prefetches, which go before bulk
+question-bank builds. Each lane has a queueing deadline, after which the call
+is rejected as busy instead of waiting forever. A 429 from the provider
+pauses all lanes for its retry-after period. Token reservations are settled
+against the real usage once the response arrives.
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from llm_executor import ExecutorBusyError
+from metrics import registry
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+BULK = "bulk"
+LANE_ORDER = {INTERACTIVE: 0, BACKGROUND: 1, BULK: 2}
+
+llm_queue_wait = registry.histogram(
+    "studyai_llm_queue_seconds", "Time LLM requests waited for rate-limit admission", ("lane",))
+llm_throttled = registry.counter(
+    "studyai_llm_throttled_total", "LLM requests rejected or paused by rate limiting", ("lane", "reason"))
+
+_current_lane = ContextVar("llm_lane", default=INTERACTIVE)
+
+
+class RateLimitTimeoutError(ExecutorBusyError):
+    """Raised when a request cannot be admitted before its lane's deadline"""
+
+
+@contextmanager
+def lane(name):
+    """Run the enclosed LLM calls in the given priority lane"""
+    token = _current_lane.set(name)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+def current_lane():
+    return _current_lane.get()
+
+
+def run_in_lane(name, fn, *args):
+    """Call fn(*args) in a priority lane (for work submitted to another thread)"""
+    with lane(name):
+        return fn(*args)
+
+
+def estimate_request_tokens(request):
+    """Rough token cost of a Messages API request: prompt text plus the output limit"""
+    chars = 0
+    system = request.get("system") or ""
+    blocks = [{"text": system}] if isinstance(system, str) else system
+    for message in request.get("messages") or []:
+        content = message.get("content", "")
+        blocks.extend([{"text": content}] if isinstance(content, str) else content)
+    for block in blocks:
+        chars += len(block.get("text", ""))
+    return chars // 4 + int(request.get("max_tokens") or 0)
+
+
+class TokenBucket:
+    """Refills at rate_per_minute, holds at most one minute's worth; may go into debt"""
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= amount
+
+    def give(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class Reservation:
+    def __init__(self, tokens, lane_name):
+        self.tokens = tokens
+        self.lane = lane_name
+
+
+class LLMRateLimiter:
+    def __init__(self, rpm=0, tpm=0, deadlines=None):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.deadlines = deadlines or {}
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+
+    def _wait_time(self, tokens, now):
+        wait = max(0.0, self._paused_until - now)
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return wait
+
+    def acquire(self, tokens, lane_name=None):
+        """Block until the request may be sent; raises RateLimitTimeoutError after the lane deadline"""
+        lane_name = lane_name or current_lane()
+        started = time.monotonic()
+        deadline_seconds = self.deadlines.get(lane_name)
+        deadline = started + deadline_seconds if deadline_seconds else None
+        ticket = (LANE_ORDER.get(lane_name, len(LANE_ORDER)), next(self._sequence))
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    if self._waiters[0] == ticket:
+                        wait = self._wait_time(tokens, now)
+                        if wait <= 0:
+                            heapq.heappop(self._waiters)
+                            if self.requests is not None:
+                                self.requests.take(1)
+                            if self.tokens is not None:
+                                self.tokens.take(tokens)
+                            self._cond.notify_all()
+                            llm_queue_wait.observe(now - started, lane=lane_name)
+                            return Reservation(tokens, lane_name)
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            llm_throttled.inc(lane=lane_name, reason="deadline")
+                            raise RateLimitTimeoutError("LLM rate limit reached, please retry shortly")
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._cond.wait(wait)
+            except BaseException:
+                if ticket in self._waiters:
+                    self._waiters.remove(ticket)
+                    heapq.heapify(self._waiters)
+                    self._cond.notify_all()
+                raise
+
+    def settle(self, reservation, usage):
+        """Return (or charge) the difference between the reserved and the actual token count.
+
+        usage=None means the request failed before using any tokens.
+        """
+        if self.tokens is None:
+            return
+        actual = sum(getattr(usage, name, 0) or 0 for name in
+                     ("input_tokens", "output_tokens", "cache_creation_input_tokens"))
+        with self._cond:
+            difference = reservation.tokens - actual
+            if difference > 0:
+                self.tokens.give(difference)
+            else:
+                self.tokens.take(-difference)
+            self._cond.notify_all()
+
+    def backoff(self, seconds, lane_name=None):
+        """Pause every lane after the provider rate limited us"""
+        llm_throttled.inc(lane=lane_name or current_lane(), reason="429")
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            lanes_by_rank = {order: name for name, order in LANE_ORDER.items()}
+            queued = {name: 0 for name in LANE_ORDER}
+            for rank, _ in self._waiters:
+                queued[lanes_by_rank[rank]] += 1
+            return {
+                'rpm_available': round(self.requests.level, 1) if self.requests else None,
+                'tpm_available': round(self.tokens.level) if self.tokens else None,
+                'paused_for': round(max(0.0, self._paused_until - now), 2),
+                'queued': queued
+            }
+
+
+def build_rate_limiter():
+    """Create the limiter configured by LLM_RPM, LLM_TPM and LLM_QUEUE_DEADLINE_* (0 = no limit)"""
+    return LLMRateLimiter(
+        rpm=int(os.getenv("LLM_RPM", "0")),
+        tpm=int(os.getenv("LLM_TPM", "0")),
+        deadlines={
+            INTERACTIVE: float(os.getenv("LLM_QUEUE_DEADLINE_INTERACTIVE", "30")),
+            BACKGROUND: float(os.getenv("LLM_QUEUE_DEADLINE_BACKGROUND", "5")),
+            BULK: float(os.getenv("LLM_QUEUE_DEADLINE_BULK", "0")),
+        }
+    )
@@ -0,0 +1,208 @@
+"""In-process metrics exported in the Prometheus text format at /metrics.
+
+Counters and histograms are kept per label set behind one lock. stage() times
+a block of work (upload parsing, prompt building, LLM call, response parsing,
+fallback) and counts its failures. A sampled fraction of requests can be
+profiled with cProfile by setting PROFILE_SAMPLE_RATE; work a sampled request
+hands to a worker thread is profiled there with profiled() / profiled_iter().
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = []
+    for name, value in zip(labelnames, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(name, "") for name in self.labelnames), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series['counts']):
+                    labels = _format_labels(self.labelnames + ("le",), key + (bound,))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labelnames + ("le",), key + ("+Inf",))
+                lines.append(f"{self.name}_bucket{labels} {series['count']}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {series['sum']}")
+                lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "studyai_http_requests_total", "HTTP requests by endpoint and status code", ("endpoint", "status"))
+http_latency = registry.histogram(
+    "studyai_http_request_seconds", "HTTP request latency by endpoint", ("endpoint",))
+stage_latency = registry.histogram(
+    "studyai_stage_seconds", "Latency of internal processing stages", ("stage",))
+stage_errors = registry.counter(
+    "studyai_stage_errors_total", "Failures of internal processing stages", ("stage",))
+llm_calls = registry.counter(
+    "studyai_llm_calls_total", "LLM API calls by model and outcome", ("model", "outcome"))
+llm_tokens = registry.counter(
+    "studyai_llm_tokens_total",
+    "LLM tokens by model and direction (input/output/cache_read/cache_write)", ("model", "direction"))
+prompt_cache_calls = registry.counter(
+    "studyai_prompt_cache_calls_total", "LLM calls by prompt-cache result (hit/write/miss)", ("model", "result"))
+cache_events = registry.counter(
+    "studyai_cache_events_total", "Cache lookups by cache and result (hit/miss)", ("cache", "result"))
+coalesced_calls = registry.counter(
+    "studyai_coalesced_calls_total", "LLM requests that joined an identical in-flight call")
+
+
+@contextmanager
+def stage(name):
+    """Time a processing stage and count it as an error if it raises"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(stage=name)
+        raise
+    finally:
+        stage_latency.observe(time.perf_counter() - start, stage=name)
+
+
+def record_llm_usage(model, usage):
+    """Count input/output and prompt-cache tokens from a Messages API usage object"""
+    if usage is None:
+        return
+    cache_read = getattr(usage, "cache_read_input_tokens", 0) or 0
+    cache_write = getattr(usage, "cache_creation_input_tokens", 0) or 0
+    llm_tokens.inc(getattr(usage, "input_tokens", 0) or 0, model=model, direction="input")
+    llm_tokens.inc(getattr(usage, "output_tokens", 0) or 0, model=model, direction="output")
+    llm_tokens.inc(cache_read, model=model, direction="cache_read")
+    llm_tokens.inc(cache_write, model=model, direction="cache_write")
+    result = "hit" if cache_read else "write" if cache_write else "miss"
+    prompt_cache_calls.inc(model=model, result=result)
+
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+profile_logger = logging.getLogger("studyai.profile")
+
+
+def start_sampled_profile(rate=None):
+    """Start cProfile for a random sample of requests (PROFILE_SAMPLE_RATE, 0 disables)"""
+    rate = PROFILE_SAMPLE_RATE if rate is None else rate
+    if rate <= 0 or random.random() >= rate:
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already active on this thread
+        return None
+    return profiler
+
+
+def finish_sampled_profile(profiler, label, limit=20):
+    """Stop a sampled profile and log its top functions by cumulative time"""
+    if profiler is None:
+        return
+    profiler.disable()
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(limit)
+    profile_logger.info("Profile for %s:\n%s", label, output.getvalue())
+
+
+def profiled(fn, label):
+    """Wrap fn so the thread that runs it profiles the call (for sampled requests handed to a worker)"""
+    def run(*args, **kwargs):
+        profiler = start_sampled_profile(rate=1)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            finish_sampled_profile(profiler, label)
+    return run
+
+
+def profiled_iter(items, label):
+    """Profile iterating items on whichever thread consumes them"""
+    profiler = start_sampled_profile(rate=1)
+    try:
+        yield from items
+    finally:
+        finish_sampled_profile(profiler, label)
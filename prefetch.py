@@ -0,0 +1,121 @@
+"""Speculative background work whose results are handed out later by key.
+
+Used to generate both follow-up sets for a question while the student is
+still answering it, and to ask about parts of long study material that no
+question covers yet. Speculative tasks share the LLM worker pool with real
+requests, so they are only scheduled while the pool has spare capacity and
+the number in flight stays within a budget. A task that has not started yet
+is never waited on, so a busy pool cannot block a request behind its own
+speculation.
+"""
+import os
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from llm_executor import ExecutorBusyError
+from llm_scheduler import BACKGROUND, run_in_lane
+from metrics import registry
+from response_cache import MemoryCacheBackend
+
+prefetch_events = registry.counter(
+    "studyai_prefetch_events_total",
+    "Speculative prefetch outcomes (scheduled/skipped/hit/miss/pending/failed)", ("result",))
+
+
+class SpeculativePrefetcher:
+    """Runs speculative tasks on the LLM executor within a budget and serves their results"""
+
+    def __init__(self, executor, max_in_flight=10, max_entries=512, ttl=900, headroom=0.5):
+        self.executor = executor
+        self.max_in_flight = max_in_flight
+        self.headroom = headroom
+        self._entries = MemoryCacheBackend(max_entries=max_entries, ttl=ttl)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.counts = {'scheduled': 0, 'skipped': 0, 'hit': 0, 'miss': 0, 'pending': 0, 'failed': 0}
+
+    def _count(self, result):
+        with self._lock:
+            self.counts[result] += 1
+        prefetch_events.inc(result=result)
+
+    def _has_capacity(self):
+        busy = self.executor.stats()['in_flight']
+        return self._in_flight < self.max_in_flight and busy < self.executor.max_workers * self.headroom
+
+    def _task_done(self, future):
+        with self._lock:
+            self._in_flight -= 1
+
+    def schedule(self, key, fn, *args):
+        """Start fn(*args) in the background unless it is already cached or over budget"""
+        if self.max_in_flight <= 0 or self._entries.get(key) is not None:
+            return False
+        with self._lock:
+            if not self._has_capacity():
+                allowed = False
+            else:
+                allowed = True
+                self._in_flight += 1
+        if not allowed:
+            self._count('skipped')
+            return False
+        try:
+            # Speculative calls queue behind interactive ones in the LLM rate limiter
+            future = self.executor.submit(run_in_lane, BACKGROUND, fn, *args)
+        except ExecutorBusyError:
+            with self._lock:
+                self._in_flight -= 1
+            self._count('skipped')
+            return False
+        future.add_done_callback(self._task_done)
+        self._entries.set(key, future)
+        self._count('scheduled')
+        return True
+
+    def take(self, key, timeout=None):
+        """Return the prefetched result for key, waiting for it only if it is already running"""
+        future = self._entries.get(key)
+        if future is None:
+            self._count('miss')
+            return None
+        if not future.done() and not future.running():
+            self._count('pending')
+            return None
+        try:
+            result = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            self._count('pending')
+            return None
+        except Exception:
+            self._count('failed')
+            return None
+        if result is None:
+            self._count('failed')
+            return None
+        self._count('hit')
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': self._in_flight, 'entries': len(self._entries), **self.counts}
+
+
+def build_followup_prefetcher(executor):
+    """Create the follow-up prefetcher configured by FOLLOWUP_PREFETCH_* environment variables"""
+    return SpeculativePrefetcher(
+        executor,
+        max_in_flight=int(os.getenv("FOLLOWUP_PREFETCH_MAX_IN_FLIGHT", "10")),
+        max_entries=int(os.getenv("FOLLOWUP_PREFETCH_SIZE", "512")),
+        ttl=int(os.getenv("FOLLOWUP_PREFETCH_TTL", "900"))
+    )
+
+
+def build_coverage_prefetcher(executor):
+    """Create the question coverage prefetcher configured by QUESTION_COVERAGE_* environment variables"""
+    return SpeculativePrefetcher(
+        executor,
+        max_in_flight=int(os.getenv("QUESTION_COVERAGE_MAX_IN_FLIGHT", "2")),
+        max_entries=int(os.getenv("QUESTION_COVERAGE_SIZE", "256")),
+        ttl=int(os.getenv("QUESTION_COVERAGE_TTL", "900"))
+    )
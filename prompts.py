@@ -0,0 +1,52 @@
+"""Prompt layout that keeps the study material in a stable, cacheable prefix.
+
+Every LLM call in a session (question generation, grading, follow-ups) sends
+the same material as a system block and only the per-question part as the
+user message. Because the prefix is byte-identical across calls, the provider
+can cache it: long material is marked with cache_control so later calls read
+it from the prompt cache instead of reprocessing it.
+"""
+import os
+
+from retrieval import estimate_tokens
+
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE", "1").lower() not in ("0", "false", "no", "off")
+# Anthropic only caches prefixes above a model-dependent minimum length; setting
+# PROMPT_CACHE_MIN_TOKENS applies one minimum to every model instead
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "0"))
+HAIKU_CACHE_MIN_TOKENS = 2048
+DEFAULT_CACHE_MIN_TOKENS = 1024
+# Material up to this size is sent whole as the shared prefix instead of per-question passages
+PROMPT_CACHE_MAX_TOKENS = int(os.getenv("PROMPT_CACHE_MAX_TOKENS", "16000")) if PROMPT_CACHE_ENABLED else 0
+
+STUDY_SYSTEM_PREFIX = (
+    "You are StudyAI, a study assistant. The student's study material is below; "
+    "the task for this request follows in the conversation.\n\n<study_material>\n"
+)
+STUDY_SYSTEM_SUFFIX = "\n</study_material>"
+
+
+def prompt_cache_min_tokens(model=None):
+    """Shortest prefix the provider caches for model (2048 tokens for Haiku, 1024 for Opus/Sonnet)"""
+    if PROMPT_CACHE_MIN_TOKENS:
+        return PROMPT_CACHE_MIN_TOKENS
+    return HAIKU_CACHE_MIN_TOKENS if "haiku" in (model or "").lower() else DEFAULT_CACHE_MIN_TOKENS
+
+
+def study_system(content, model=None):
+    """System blocks holding the study material, marked for prompt caching when long enough for model"""
+    block = {"type": "text", "text": STUDY_SYSTEM_PREFIX + content + STUDY_SYSTEM_SUFFIX}
+    if PROMPT_CACHE_ENABLED and estimate_tokens(block["text"]) >= prompt_cache_min_tokens(model):
+        block["cache_control"] = {"type": "ephemeral"}
+    return [block]
+
+
+def study_request(content, prompt, prefill=None, model=None):
+    """Messages API arguments: material as the shared system prefix, the per-call prompt as a short suffix"""
+    messages = [{"role": "user", "content": prompt}]
+    if prefill:
+        messages.append({"role": "assistant", "content": prefill})
+    request = {"messages": messages}
+    if content:
+        request["system"] = study_system(content, model)
+    return request
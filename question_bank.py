@@ -0,0 +1,381 @@
+"""Pre-generated question/answer banks keyed by document ID.
+
+Banks are built offline by llm_integration.py: each document is chunked,
+every chunk gets its own set of questions, and finished chunks are recorded so
+an interrupted build resumes where it stopped. Documents are keyed by the same
+content hash as the document store, so uploading a file that was banked lets
+/generate_questions answer from the bank without a live LLM call.
+
+Questions generated live are stored per content-defined chunk (keyed by the
+chunk's hash), so when edited notes are uploaded again only the changed
+chunks need new questions and the rest are reused. New questions that are
+near-duplicates (MinHash/LSH, see dedup.py) of one already stored for the same
+material are dropped on insert, so repeated generations do not pile up
+paraphrases of the same question.
+"""
+import json
+import os
+import random
+import sqlite3
+import threading
+from datetime import datetime
+
+from dedup import DEFAULT_THRESHOLD, is_near_duplicate, question_buckets
+from metrics import registry
+
+DEFAULT_BANK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "question_bank.db")
+
+BANK_PROMPT = (
+    "Based on the study material, generate exactly {count} thoughtful questions and answers that test "
+    "understanding and application. IMPORTANT: Return ONLY valid JSON, Format: an array of objects, each with "
+    "\"Question\" and \"Answer\" keys, No explanations, no prefixes, no markdown, no text outside the JSON."
+)
+
+SECTION_PROMPT = (
+    "The study material is split into numbered sections. Based on it, generate exactly {count} thoughtful "
+    "questions and answers that test understanding and application. IMPORTANT: Return ONLY valid JSON, Format: "
+    "an array of objects, each with \"Question\", \"Answer\" and \"Section\" keys, where Section is the number "
+    "of the section the question is about, No explanations, no prefixes, no markdown, no text outside the JSON."
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bank_documents (
+    document_id TEXT PRIMARY KEY,
+    source_path TEXT NOT NULL,
+    chunks INTEGER NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bank_chunks (
+    document_id TEXT NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (document_id, chunk_index)
+);
+CREATE TABLE IF NOT EXISTS bank_questions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    document_id TEXT NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_bank_questions_document ON bank_questions(document_id);
+CREATE TABLE IF NOT EXISTS generated_chunks (
+    chunk_hash TEXT PRIMARY KEY,
+    questions INTEGER NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunk_questions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chunk_hash TEXT NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chunk_questions_chunk ON chunk_questions(chunk_hash);
+CREATE TABLE IF NOT EXISTS question_buckets (
+    bucket INTEGER NOT NULL,
+    question_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_question_buckets_bucket ON question_buckets(bucket);
+CREATE TABLE IF NOT EXISTS bank_question_buckets (
+    bucket INTEGER NOT NULL,
+    question_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_bank_question_buckets_bucket ON bank_question_buckets(bucket);
+CREATE INDEX IF NOT EXISTS idx_bank_question_buckets_question ON bank_question_buckets(question_id);
+"""
+# Bumped whenever dedup.py changes how buckets are computed, so stored buckets are rebuilt
+BUCKET_VERSION = 2
+# A chunk sent this many times without getting a question (e.g. a reference list) is not sent again
+MAX_CHUNK_ATTEMPTS = 3
+# Keeps IN (...) lists under SQLite's bound-parameter limit
+QUERY_BATCH = 500
+
+question_duplicates = registry.counter(
+    "studyai_question_duplicates_total", "Generated questions dropped as near-duplicates of stored ones")
+
+
+def parse_question_pairs(output):
+    """Parse an LLM reply into (question, answer) pairs"""
+    data = json.loads(output)
+    if not isinstance(data, list):
+        raise ValueError("Expected a JSON array of questions")
+    return [(str(item["Question"]), str(item["Answer"])) for item in data]
+
+
+def number_sections(chunks):
+    """Label chunks as numbered sections for SECTION_PROMPT"""
+    return "\n\n".join(f"[Section {number}]\n{chunk.strip()}" for number, chunk in enumerate(chunks, start=1))
+
+
+def questions_by_section(questions_data, chunk_hashes):
+    """Group Question/Answer objects by the chunk their Section number refers to.
+
+    Questions with a missing or out-of-range Section are attributed to the first chunk.
+    """
+    grouped = {chunk_hash: [] for chunk_hash in chunk_hashes}
+    for item in questions_data:
+        try:
+            position = int(item.get("Section", 1)) - 1
+        except (TypeError, ValueError):
+            position = 0
+        if not 0 <= position < len(chunk_hashes):
+            position = 0
+        grouped[chunk_hashes[position]].append((str(item["Question"]), str(item["Answer"])))
+    return grouped
+
+
+class QuestionBank:
+    """SQLite (WAL) question bank with one connection per thread"""
+
+    def __init__(self, path=None, dedup_threshold=None):
+        self.path = path or os.getenv("QUESTION_BANK_PATH", DEFAULT_BANK_PATH)
+        if dedup_threshold is None:
+            dedup_threshold = float(os.getenv("QUESTION_DEDUP_THRESHOLD", str(DEFAULT_THRESHOLD)))
+        self.dedup_threshold = dedup_threshold
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        self._migrate(conn)
+        self._index_missing(conn)
+        conn.commit()
+
+    def _migrate(self, conn):
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(generated_chunks)")}
+        if 'attempts' not in columns:
+            conn.execute("ALTER TABLE generated_chunks ADD COLUMN attempts INTEGER NOT NULL DEFAULT 1")
+
+    def _index_missing(self, conn):
+        """Add LSH buckets for stored questions that have none (or were indexed by an older dedup.py)"""
+        if conn.execute("PRAGMA user_version").fetchone()[0] < BUCKET_VERSION:
+            conn.execute("DELETE FROM question_buckets")
+            conn.execute("DELETE FROM bank_question_buckets")
+            conn.execute(f"PRAGMA user_version = {BUCKET_VERSION}")
+        for questions_table, buckets_table in (("chunk_questions", "question_buckets"),
+                                               ("bank_questions", "bank_question_buckets")):
+            rows = conn.execute(
+                f"SELECT id, question FROM {questions_table} "
+                f"WHERE id NOT IN (SELECT DISTINCT question_id FROM {buckets_table})"
+            ).fetchall()
+            for row in rows:
+                self._add_buckets(conn, row['id'], question_buckets(row['question']), buckets_table)
+
+    def _add_buckets(self, conn, question_id, buckets, table="question_buckets"):
+        conn.executemany(f"INSERT INTO {table} (bucket, question_id) VALUES (?, ?)",
+                         [(bucket, question_id) for bucket in buckets])
+
+    def _find_similar(self, conn, question, buckets, chunk_hashes=None):
+        placeholders = ",".join("?" * len(buckets))
+        candidates = conn.execute(
+            "SELECT DISTINCT q.id, q.chunk_hash, q.question FROM question_buckets b "
+            f"JOIN chunk_questions q ON q.id = b.question_id WHERE b.bucket IN ({placeholders})",
+            buckets
+        ).fetchall()
+        for row in candidates:
+            if chunk_hashes is not None and row['chunk_hash'] not in chunk_hashes:
+                continue
+            if is_near_duplicate(question, row['question'], self.dedup_threshold):
+                return row['question']
+        return None
+
+    def _find_similar_banked(self, conn, document_id, question, buckets):
+        placeholders = ",".join("?" * len(buckets))
+        candidates = conn.execute(
+            "SELECT DISTINCT q.id, q.question FROM bank_question_buckets b "
+            f"JOIN bank_questions q ON q.id = b.question_id WHERE b.bucket IN ({placeholders}) AND q.document_id = ?",
+            buckets + [document_id]
+        ).fetchall()
+        for row in candidates:
+            if is_near_duplicate(question, row['question'], self.dedup_threshold):
+                return row['question']
+        return None
+
+    def find_similar(self, question, chunk_hashes=None):
+        """Return a stored question similar to this one (optionally only among these chunks), or None"""
+        if self.dedup_threshold <= 0:
+            return None
+        chunk_hashes = set(chunk_hashes) if chunk_hashes is not None else None
+        return self._find_similar(self._connection(), question, question_buckets(question), chunk_hashes)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def register_document(self, document_id, source_path, chunks):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO bank_documents (document_id, source_path, chunks, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(document_id) DO UPDATE SET source_path = excluded.source_path, "
+                "chunks = excluded.chunks, updated_at = excluded.updated_at",
+                (document_id, source_path, chunks, datetime.now().isoformat())
+            )
+
+    def completed_chunks(self, document_id):
+        """Chunk indexes that already have questions (the resume checkpoint)"""
+        rows = self._connection().execute(
+            "SELECT chunk_index FROM bank_chunks WHERE document_id = ? AND status = 'done'", (document_id,)
+        ).fetchall()
+        return {row['chunk_index'] for row in rows}
+
+    def save_chunk(self, document_id, chunk_index, pairs):
+        """Store a chunk's questions and mark it done in one transaction.
+
+        A question similar to one already banked for the document (or an earlier one in pairs) is dropped.
+        Returns the number of questions kept.
+        """
+        conn = self._connection()
+        kept = 0
+        with conn:
+            conn.execute(
+                "DELETE FROM bank_question_buckets WHERE question_id IN "
+                "(SELECT id FROM bank_questions WHERE document_id = ? AND chunk_index = ?)",
+                (document_id, chunk_index)
+            )
+            conn.execute("DELETE FROM bank_questions WHERE document_id = ? AND chunk_index = ?",
+                         (document_id, chunk_index))
+            for question, answer in pairs:
+                buckets = question_buckets(question)
+                if self.dedup_threshold > 0 and self._find_similar_banked(conn, document_id, question, buckets):
+                    question_duplicates.inc()
+                    continue
+                cursor = conn.execute(
+                    "INSERT INTO bank_questions (document_id, chunk_index, question, answer) VALUES (?, ?, ?, ?)",
+                    (document_id, chunk_index, question, answer)
+                )
+                self._add_buckets(conn, cursor.lastrowid, buckets, "bank_question_buckets")
+                kept += 1
+            conn.execute(
+                "INSERT OR REPLACE INTO bank_chunks (document_id, chunk_index, status, error, updated_at) "
+                "VALUES (?, ?, 'done', NULL, ?)",
+                (document_id, chunk_index, datetime.now().isoformat())
+            )
+        return kept
+
+    def mark_failed(self, document_id, chunk_index, error):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO bank_chunks (document_id, chunk_index, status, error, updated_at) "
+                "VALUES (?, ?, 'failed', ?, ?)",
+                (document_id, chunk_index, str(error), datetime.now().isoformat())
+            )
+
+    def sample_questions(self, document_ids, count=5):
+        """Return up to count random (question, answer) pairs banked for these documents"""
+        if not document_ids:
+            return []
+        placeholders = ",".join("?" * len(document_ids))
+        rows = self._connection().execute(
+            f"SELECT question, answer FROM bank_questions WHERE document_id IN ({placeholders}) "
+            "ORDER BY RANDOM() LIMIT ?",
+            list(document_ids) + [count]
+        ).fetchall()
+        return [(row['question'], row['answer']) for row in rows]
+
+    def chunk_progress(self, chunk_hashes):
+        """Map each known chunk hash to its (questions asked, generation attempts); unseen chunks are absent"""
+        conn = self._connection()
+        chunk_hashes = list(dict.fromkeys(chunk_hashes))
+        progress = {}
+        for start in range(0, len(chunk_hashes), QUERY_BATCH):
+            batch = chunk_hashes[start:start + QUERY_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT chunk_hash, questions, attempts FROM generated_chunks WHERE chunk_hash IN ({placeholders})",
+                batch
+            ).fetchall()
+            progress.update((row['chunk_hash'], (row['questions'], row['attempts'])) for row in rows)
+        return progress
+
+    def generated_chunks(self, chunk_hashes):
+        """Chunk hashes that already have questions from live generation (or ran out of attempts)"""
+        return {chunk_hash for chunk_hash, (questions, attempts) in self.chunk_progress(chunk_hashes).items()
+                if questions > 0 or attempts >= MAX_CHUNK_ATTEMPTS}
+
+    def register_chunks(self, chunk_hashes):
+        """Record chunks as seen without asking about them, so only later edits count as new material"""
+        now = datetime.now().isoformat()
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO generated_chunks (chunk_hash, questions, attempts, updated_at) "
+                "VALUES (?, 0, 0, ?)",
+                [(chunk_hash, now) for chunk_hash in dict.fromkeys(chunk_hashes)]
+            )
+
+    def save_chunk_questions(self, grouped, scope=None):
+        """Store questions per chunk hash and count one generation attempt for every chunk in grouped.
+
+        A chunk counts as generated once the LLM has asked about it (even if every question was dropped
+        as a duplicate); the others stay eligible for later calls until MAX_CHUNK_ATTEMPTS. A question similar to one already stored for a chunk in scope (all chunks when None), or to an
+        earlier one in this batch, is dropped. Returns the questions that were kept, grouped the same way.
+        """
+        now = datetime.now().isoformat()
+        scope = set(scope) | set(grouped) if scope is not None else None
+        kept = {}
+        asked = {chunk_hash: len(pairs) for chunk_hash, pairs in grouped.items()}
+        conn = self._connection()
+        with conn:
+            for chunk_hash, pairs in grouped.items():
+                kept[chunk_hash] = []
+                for question, answer in pairs:
+                    buckets = question_buckets(question)
+                    if self.dedup_threshold > 0 and self._find_similar(conn, question, buckets, scope):
+                        question_duplicates.inc()
+                        continue
+                    cursor = conn.execute(
+                        "INSERT INTO chunk_questions (chunk_hash, question, answer) VALUES (?, ?, ?)",
+                        (chunk_hash, question, answer)
+                    )
+                    self._add_buckets(conn, cursor.lastrowid, buckets)
+                    kept[chunk_hash].append((question, answer))
+            conn.executemany(
+                "INSERT INTO generated_chunks (chunk_hash, questions, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(chunk_hash) DO UPDATE SET questions = questions + excluded.questions, "
+                "attempts = attempts + 1, updated_at = excluded.updated_at",
+                [(chunk_hash, count, now) for chunk_hash, count in asked.items()]
+            )
+        return kept
+
+    def sample_chunk_questions(self, chunk_hashes, count=5):
+        """Return up to count random (question, answer) pairs stored for these chunks"""
+        conn = self._connection()
+        chunk_hashes = list(dict.fromkeys(chunk_hashes))
+        pairs = []
+        for start in range(0, len(chunk_hashes), QUERY_BATCH):
+            batch = chunk_hashes[start:start + QUERY_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT question, answer FROM chunk_questions WHERE chunk_hash IN ({placeholders}) "
+                "ORDER BY RANDOM() LIMIT ?",
+                batch + [count]
+            ).fetchall()
+            pairs.extend((row['question'], row['answer']) for row in rows)
+        random.shuffle(pairs)
+        return pairs[:count]
+
+    def stats(self):
+        conn = self._connection()
+        return {
+            'documents': conn.execute("SELECT COUNT(*) FROM bank_documents").fetchone()[0],
+            'questions': conn.execute("SELECT COUNT(*) FROM bank_questions").fetchone()[0],
+            'failed_chunks': conn.execute("SELECT COUNT(*) FROM bank_chunks WHERE status = 'failed'").fetchone()[0],
+            'generated_chunks': conn.execute("SELECT COUNT(*) FROM generated_chunks WHERE questions > 0").fetchone()[0]
+        }
+
+
+def build_question_bank():
+    """Open the question bank at QUESTION_BANK_PATH (default data/question_bank.db)"""
+    return QuestionBank()
@@ -0,0 +1,234 @@
+"""Cache for LLM responses keyed on a hash of model, prompt template and inputs.
+
+Two backends are available: an in-memory LRU (default) and an on-disk SQLite
+table that survives restarts and can be shared by several worker processes.
+Only JSON-serialisable values are cached. SingleFlight makes concurrent
+misses for the same key share one LLM call instead of each making their own.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import cache_events, coalesced_calls
+
+
+def make_cache_key(model, template, *inputs):
+    """Fingerprint an LLM request so identical requests share a cache entry"""
+    payload = json.dumps([model, template, list(inputs)], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryCacheBackend:
+    """LRU cache with a maximum entry count and per-entry TTL"""
+
+    def __init__(self, max_entries=1024, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at and expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl if self.ttl else 0
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """Persistent cache stored in a single SQLite table"""
+
+    def __init__(self, path, max_entries=10000, ttl=86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_response_cache_created ON response_cache(created_at)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at and expires_at < time.time():
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+        return json.loads(value)
+
+    def set(self, key, value):
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl else 0
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, expires_at)
+            )
+            self._conn.execute(
+                "DELETE FROM response_cache WHERE key IN ("
+                "SELECT key FROM response_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache")
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+class ResponseCache:
+    """Front for a cache backend that counts hits and misses"""
+
+    def __init__(self, backend, name="response"):
+        self.backend = backend
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        cache_events.inc(cache=self.name, result="miss" if value is None else "hit")
+        return value
+
+    def peek(self, key):
+        """Look up a key without counting it as a hit or miss"""
+        return self.backend.get(key)
+
+    def set(self, key, value):
+        if value is not None:
+            self.backend.set(key, value)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0
+        }
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one execution.
+
+    The first caller runs fn; callers arriving while it is running wait for it
+    and get the same result, or the same exception re-raised.
+    """
+
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, timeout=None):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            coalesced_calls.inc()
+            if not flight.done.wait(timeout or self.timeout):
+                raise TimeoutError("Timed out waiting for an identical in-flight request")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn(*args)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'executions': self.executions,
+                'coalesced': self.coalesced
+            }
+
+
+def build_response_cache():
+    """Create the response cache configured by RESPONSE_CACHE_* environment variables"""
+    backend_name = os.getenv("RESPONSE_CACHE_BACKEND", "memory").lower()
+    ttl = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+    max_entries = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+    if backend_name == "sqlite":
+        default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "response_cache.db")
+        path = os.getenv("RESPONSE_CACHE_PATH", default_path)
+        return ResponseCache(SQLiteCacheBackend(path, max_entries=max_entries, ttl=ttl))
+    return ResponseCache(MemoryCacheBackend(max_entries=max_entries, ttl=ttl))
@@ -0,0 +1,144 @@
+"""Chunking and BM25 retrieval over uploaded study material.
+
+Stored documents use their content-defined chunks as passages; term
+frequencies are computed once per chunk hash, so re-indexing an edited
+document only tokenizes the chunks that changed. The BM25 index (sparse
+term-frequency dicts) is persisted next to each document. Grading and
+follow-up prompts then carry only the passages most relevant to the question,
+up to a token budget, instead of the whole document.
+"""
+import math
+import re
+from collections import Counter
+
+from grading import STOPWORDS
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+CHARS_PER_TOKEN = 4
+
+
+def tokenize(text):
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+def term_frequencies(text):
+    return dict(Counter(tokenize(text)))
+
+
+def estimate_tokens(text):
+    """Rough token count used for prompt budgeting"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def chunk_text(text, chunk_chars=1200, overlap_chars=200):
+    """Split text into passages of about chunk_chars, breaking on paragraphs or sentences"""
+    text = text.strip()
+    if not text:
+        return []
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_chars, len(text))
+        if end < len(text):
+            window = text[start:end]
+            # Prefer a paragraph break, then a sentence break, in the second half of the window
+            cut = window.rfind("\n\n", chunk_chars // 2)
+            if cut == -1:
+                cut = max(window.rfind(". ", chunk_chars // 2), window.rfind("\n", chunk_chars // 2))
+            if cut != -1:
+                end = start + cut + 1
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        next_start = max(end - overlap_chars, start + 1)
+        # Start the overlap on a word boundary
+        space = text.find(" ", next_start, end)
+        start = space + 1 if space != -1 else next_start
+    return chunks
+
+
+class BM25Index:
+    """Okapi BM25 over a list of passages, stored as sparse term-frequency dicts"""
+
+    def __init__(self, chunks, term_freqs, doc_freqs, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.term_freqs = term_freqs
+        self.doc_freqs = doc_freqs
+        self.lengths = [sum(tf.values()) for tf in term_freqs]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def build(cls, chunks, term_freqs=None):
+        if term_freqs is None:
+            term_freqs = [term_frequencies(chunk) for chunk in chunks]
+        doc_freqs = Counter()
+        for tf in term_freqs:
+            doc_freqs.update(tf.keys())
+        return cls(chunks, term_freqs, dict(doc_freqs))
+
+    @classmethod
+    def from_text(cls, text, chunk_chars=1200, overlap_chars=200):
+        return cls.build(chunk_text(text, chunk_chars, overlap_chars))
+
+    def to_dict(self):
+        return {'chunks': self.chunks, 'term_freqs': self.term_freqs, 'doc_freqs': self.doc_freqs}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['chunks'], data['term_freqs'], data['doc_freqs'])
+
+    def idf(self, term):
+        n = len(self.chunks)
+        df = self.doc_freqs.get(term, 0)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def scores(self, query):
+        """Return the BM25 score of every passage for a query"""
+        query_terms = set(tokenize(query))
+        results = [0.0] * len(self.chunks)
+        for term in query_terms:
+            if term not in self.doc_freqs:
+                continue
+            idf = self.idf(term)
+            for i, tf in enumerate(self.term_freqs):
+                freq = tf.get(term)
+                if not freq:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[i] / (self.avg_length or 1))
+                results[i] += idf * freq * (self.k1 + 1) / (freq + norm)
+        return results
+
+
+def select_passages(indexes, query, token_budget=2000, top_k=8):
+    """Pick the top passages across several indexes that fit in token_budget.
+
+    Passages are returned grouped by document and in their original order so the
+    prompt still reads naturally. If everything fits, all text is returned.
+    """
+    total_tokens = sum(estimate_tokens(chunk) for index in indexes for chunk in index.chunks)
+    if total_tokens <= token_budget:
+        return "\n\n".join("\n\n".join(index.chunks) for index in indexes)
+
+    ranked = []
+    for doc_position, index in enumerate(indexes):
+        for chunk_position, score in enumerate(index.scores(query)):
+            ranked.append((score, doc_position, chunk_position))
+    ranked.sort(key=lambda item: item[0], reverse=True)
+
+    selected = []
+    used = 0
+    for score, doc_position, chunk_position in ranked:
+        if len(selected) >= top_k:
+            break
+        cost = estimate_tokens(indexes[doc_position].chunks[chunk_position])
+        if used + cost > token_budget:
+            continue
+        selected.append((doc_position, chunk_position))
+        used += cost
+
+    selected.sort()
+    return "\n\n".join(indexes[d].chunks[c] for d, c in selected)
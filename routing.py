@@ -0,0 +1,93 @@
+"""Per-task model routing with escalation on invalid output.
+
+Each kind of LLM call (question generation, grading, batch grading,
+follow-ups) has its own model and output token limit, read from the
+environment. Short, structured tasks default to a fast model; when its reply
+fails validation the same request is retried once on the escalation model, so
+quality problems cost one extra call instead of running every call on the
+largest model.
+"""
+import logging
+import os
+
+from llm_client import llm_provider
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+FAST_MODEL = "claude-3-5-haiku-20241022"
+BALANCED_MODEL = "claude-sonnet-4-20250514"
+LARGE_MODEL = "claude-opus-4-1-20250805"
+
+# task: (default model, default max_tokens)
+TASK_DEFAULTS = {
+    "questions": (BALANCED_MODEL, 1024),
+    "grading": (FAST_MODEL, 512),
+    "batch_grading": (FAST_MODEL, 300),  # per answer
+    "followup": (FAST_MODEL, 256),
+}
+
+llm_escalations = registry.counter(
+    "studyai_llm_escalations_total", "LLM calls retried on the escalation model after invalid output", ("task",))
+
+
+class ModelRoute:
+    def __init__(self, task, model, max_tokens, escalate_to=None):
+        self.task = task
+        self.model = model
+        self.max_tokens = max_tokens
+        self.escalate_to = escalate_to if escalate_to != model else None
+
+    def to_dict(self):
+        return {'model': self.model, 'max_tokens': self.max_tokens, 'escalate_to': self.escalate_to}
+
+
+def load_routes():
+    """Read LLM_MODEL_<TASK>, LLM_MAX_TOKENS_<TASK> and LLM_ESCALATION_MODEL ('' disables escalation)"""
+    escalate_to = os.getenv("LLM_ESCALATION_MODEL", LARGE_MODEL) or None
+    routes = {}
+    for task, (model, max_tokens) in TASK_DEFAULTS.items():
+        routes[task] = ModelRoute(
+            task,
+            os.getenv(f"LLM_MODEL_{task.upper()}", model),
+            int(os.getenv(f"LLM_MAX_TOKENS_{task.upper()}", str(max_tokens))),
+            escalate_to
+        )
+    return routes
+
+
+ROUTES = load_routes()
+
+
+def route(task):
+    return ROUTES[task]
+
+
+def complete(task, parse, request, max_tokens=None, prefill=""):
+    """Run a request on the task's model and parse the reply, escalating once if parsing fails.
+
+    parse receives prefill + reply text and raises ValueError/KeyError/TypeError on invalid output.
+    API errors are not escalated; they propagate to the caller's fallback.
+    """
+    task_route = route(task)
+    max_tokens = max_tokens or task_route.max_tokens
+    message = llm_provider.create_message(model=task_route.model, max_tokens=max_tokens, **request)
+    try:
+        return parse(prefill + message.content[0].text)
+    except (ValueError, KeyError, TypeError) as e:
+        if not task_route.escalate_to:
+            raise
+        logger.info("Invalid %s output from %s (%s), escalating to %s", task, task_route.model, e, task_route.escalate_to)
+    return escalate(task, parse, request, max_tokens, prefill)
+
+
+def escalate(task, parse, request, max_tokens=None, prefill=""):
+    """Retry a request on the escalation model (used when a cheaper model's output was invalid)"""
+    task_route = route(task)
+    if not task_route.escalate_to:
+        raise ValueError(f"No escalation model configured for {task}")
+    llm_escalations.inc(task=task)
+    message = llm_provider.create_message(
+        model=task_route.escalate_to, max_tokens=max_tokens or task_route.max_tokens, **request
+    )
+    return parse(prefill + message.content[0].text)
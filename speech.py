@@ -0,0 +1,195 @@
+"""Incremental speech-to-text for spoken answers.
+
+Audio arrives as 16-bit mono PCM chunks while the student is still speaking,
+and each chunk is fed straight into a local recognizer, so a partial
+transcript is available after every chunk and the final one as soon as the
+recording stops. Engines are pluggable; Vosk is the default and is an optional
+dependency (pip install vosk, plus a model directory in VOSK_MODEL_PATH).
+"""
+import io
+import json
+import os
+import threading
+import time
+import uuid
+import wave
+
+DEFAULT_SAMPLE_RATE = 16000
+
+
+class SpeechError(ValueError):
+    """Raised for a bad speech request (unknown stream, out-of-order chunk, bad audio)"""
+
+
+class SpeechUnavailableError(RuntimeError):
+    """Raised when no speech engine is configured"""
+
+
+class VoskEngine:
+    """Offline recognition with Vosk; the model is loaded once and shared by all streams"""
+
+    name = "vosk"
+
+    def __init__(self, model_path):
+        try:
+            from vosk import Model, SetLogLevel
+        except ImportError:
+            raise SpeechUnavailableError("Speech-to-text requires the 'vosk' package (pip install vosk)")
+        if not model_path or not os.path.isdir(model_path):
+            raise SpeechUnavailableError("Set VOSK_MODEL_PATH to a downloaded Vosk model directory")
+        SetLogLevel(-1)
+        self.model = Model(model_path)
+
+    def recognizer(self, sample_rate):
+        return VoskRecognizer(self.model, sample_rate)
+
+
+class VoskRecognizer:
+    def __init__(self, model, sample_rate):
+        from vosk import KaldiRecognizer
+        self._recognizer = KaldiRecognizer(model, sample_rate)
+        self._segments = []
+
+    def _text(self):
+        return " ".join(segment for segment in self._segments if segment)
+
+    def accept(self, pcm):
+        """Feed PCM audio and return the transcript so far"""
+        if self._recognizer.AcceptWaveform(pcm):
+            self._segments.append(json.loads(self._recognizer.Result()).get("text", ""))
+            return self._text()
+        partial = json.loads(self._recognizer.PartialResult()).get("partial", "")
+        return (self._text() + " " + partial).strip()
+
+    def finish(self):
+        """Flush the recognizer and return the final transcript"""
+        self._segments.append(json.loads(self._recognizer.FinalResult()).get("text", ""))
+        return self._text()
+
+
+ENGINES = {
+    "vosk": lambda: VoskEngine(os.getenv("VOSK_MODEL_PATH")),
+}
+
+
+def build_speech_engine():
+    """Create the engine named by SPEECH_ENGINE, or None (with the reason) if it is unavailable"""
+    name = os.getenv("SPEECH_ENGINE", "vosk").lower()
+    factory = ENGINES.get(name)
+    if factory is None:
+        return None, f"Unknown SPEECH_ENGINE: {name}"
+    try:
+        return factory(), None
+    except SpeechUnavailableError as e:
+        return None, str(e)
+
+
+class SpeechStream:
+    def __init__(self, recognizer, sample_rate):
+        self.id = uuid.uuid4().hex
+        self.recognizer = recognizer
+        self.sample_rate = sample_rate
+        self.next_seq = 0
+        self.bytes = 0
+        self.transcript = ""
+        self.last_used = time.time()
+        self.lock = threading.Lock()
+
+
+class SpeechStreams:
+    """Open transcription streams with a concurrency cap and an idle timeout"""
+
+    def __init__(self, engine, max_streams=32, idle_ttl=120, max_seconds=300, engine_error=None):
+        self.engine = engine
+        self.engine_error = engine_error
+        self.max_streams = max_streams
+        self.idle_ttl = idle_ttl
+        self.max_seconds = max_seconds
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def _prune(self):
+        cutoff = time.time() - self.idle_ttl
+        for stream_id in [sid for sid, s in self._streams.items() if s.last_used < cutoff]:
+            del self._streams[stream_id]
+
+    def start(self, sample_rate=DEFAULT_SAMPLE_RATE):
+        if self.engine is None:
+            raise SpeechUnavailableError(self.engine_error or "Speech-to-text engine is not available")
+        stream = SpeechStream(self.engine.recognizer(sample_rate), sample_rate)
+        with self._lock:
+            self._prune()
+            if len(self._streams) >= self.max_streams:
+                raise SpeechUnavailableError("Too many recordings in progress, please retry shortly")
+            self._streams[stream.id] = stream
+        return stream
+
+    def _get(self, stream_id):
+        with self._lock:
+            stream = self._streams.get(stream_id)
+        if stream is None:
+            raise SpeechError("Unknown or expired recording")
+        return stream
+
+    def feed(self, stream_id, seq, pcm):
+        """Transcribe the next chunk of a stream and return the partial transcript"""
+        stream = self._get(stream_id)
+        with stream.lock:
+            if seq != stream.next_seq:
+                raise SpeechError(f"Expected chunk {stream.next_seq}, got {seq}")
+            if len(pcm) % 2:
+                raise SpeechError("Audio must be 16-bit PCM")
+            stream.bytes += len(pcm)
+            if stream.bytes > self.max_seconds * stream.sample_rate * 2:
+                raise SpeechError(f"Recordings are limited to {self.max_seconds} seconds")
+            stream.transcript = stream.recognizer.accept(pcm)
+            stream.next_seq += 1
+            stream.last_used = time.time()
+            return stream.transcript
+
+    def finish(self, stream_id):
+        """Close a stream and return its final transcript"""
+        stream = self._get(stream_id)
+        with stream.lock:
+            with self._lock:
+                self._streams.pop(stream_id, None)
+            return stream.recognizer.finish()
+
+    def transcribe_wav(self, data):
+        """Transcribe a complete 16-bit mono WAV recording"""
+        if self.engine is None:
+            raise SpeechUnavailableError(self.engine_error or "Speech-to-text engine is not available")
+        try:
+            with wave.open(io.BytesIO(data)) as wav:
+                if wav.getsampwidth() != 2 or wav.getnchannels() != 1:
+                    raise SpeechError("Audio must be 16-bit mono WAV")
+                recognizer = self.engine.recognizer(wav.getframerate())
+                while True:
+                    frames = wav.readframes(4000)
+                    if not frames:
+                        break
+                    recognizer.accept(frames)
+        except (wave.Error, EOFError) as e:
+            raise SpeechError(f"Could not read WAV audio: {e}")
+        return recognizer.finish()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'engine': getattr(self.engine, "name", None),
+                'error': self.engine_error,
+                'open_streams': len(self._streams)
+            }
+
+
+def build_speech_streams():
+    """Create the stream registry configured by SPEECH_* environment variables"""
+    engine, error = build_speech_engine()
+    streams = SpeechStreams(
+        engine,
+        max_streams=int(os.getenv("SPEECH_MAX_STREAMS", "32")),
+        idle_ttl=int(os.getenv("SPEECH_STREAM_TTL", "120")),
+        max_seconds=int(os.getenv("SPEECH_MAX_SECONDS", "300")),
+        engine_error=error
+    )
+    return streams
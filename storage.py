@@ -0,0 +1,339 @@
+"""Persistent storage for study sessions, uploads and generated questions.
+
+SQLite in WAL mode is the default backend: it survives restarts, lets several
+gunicorn workers share one database file, and allocates IDs atomically with
+AUTOINCREMENT instead of len(...) + 1.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from response_cache import MemoryCacheBackend
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "studyai.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    questions TEXT NOT NULL,
+    answers TEXT NOT NULL,
+    scores TEXT NOT NULL,
+    total_score REAL NOT NULL,
+    accuracy REAL NOT NULL,
+    topic TEXT NOT NULL DEFAULT 'general'
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_user_time ON sessions(user_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_sessions_time ON sessions(timestamp);
+
+CREATE TABLE IF NOT EXISTS uploads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    document_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    uploaded_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_uploads_user_time ON uploads(user_id, uploaded_at);
+CREATE INDEX IF NOT EXISTS idx_uploads_document ON uploads(document_id);
+
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    question_hash TEXT NOT NULL UNIQUE,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    source_key TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_questions_source ON questions(source_key);
+
+-- Running aggregates maintained by save_session(); user_id '*' holds the global rollup
+CREATE TABLE IF NOT EXISTS analytics_totals (
+    user_id TEXT PRIMARY KEY,
+    sessions INTEGER NOT NULL,
+    score_sum REAL NOT NULL,
+    accuracy_sum REAL NOT NULL,
+    answers INTEGER NOT NULL,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS analytics_daily (
+    user_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    sessions INTEGER NOT NULL,
+    score_sum REAL NOT NULL,
+    accuracy_sum REAL NOT NULL,
+    PRIMARY KEY (user_id, day)
+);
+CREATE TABLE IF NOT EXISTS analytics_topics (
+    user_id TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    sessions INTEGER NOT NULL,
+    score_sum REAL NOT NULL,
+    accuracy_sum REAL NOT NULL,
+    PRIMARY KEY (user_id, topic)
+);
+CREATE TABLE IF NOT EXISTS analytics_score_histogram (
+    user_id TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, score)
+);
+"""
+
+ALL_USERS = "*"
+DEFAULT_TOPIC = "general"
+
+
+def question_hash(question):
+    return hashlib.sha256(question.strip().encode("utf-8")).hexdigest()
+
+
+class SQLiteStorage:
+    """SQLite (WAL) storage with one connection per thread and an LRU cache of reference answers"""
+
+    def __init__(self, path=None, cache_size=1024):
+        self.path = path or os.getenv("STORAGE_PATH", DEFAULT_DB_PATH)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._answers_cache = MemoryCacheBackend(max_entries=cache_size, ttl=0)
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        self._migrate(conn)
+        conn.commit()
+
+    def _migrate(self, conn):
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(sessions)")}
+        if 'topic' not in columns:
+            conn.execute(f"ALTER TABLE sessions ADD COLUMN topic TEXT NOT NULL DEFAULT '{DEFAULT_TOPIC}'")
+        totals_columns = {row['name'] for row in conn.execute("PRAGMA table_info(analytics_totals)")}
+        if 'updated_at' not in totals_columns:
+            conn.execute("ALTER TABLE analytics_totals ADD COLUMN updated_at TEXT")
+        has_sessions = conn.execute("SELECT 1 FROM sessions LIMIT 1").fetchone()
+        has_totals = conn.execute("SELECT 1 FROM analytics_totals LIMIT 1").fetchone()
+        if has_sessions and not has_totals:
+            self.rebuild_analytics(conn)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _session_from_row(row):
+        return {
+            'id': row['id'],
+            'user_id': row['user_id'],
+            'timestamp': row['timestamp'],
+            'questions': json.loads(row['questions']),
+            'answers': json.loads(row['answers']),
+            'scores': json.loads(row['scores']),
+            'total_score': row['total_score'],
+            'accuracy': row['accuracy'],
+            'topic': row['topic']
+        }
+
+    def save_session(self, user_id, session):
+        """Insert a session, update the running analytics and return it with its allocated ID"""
+        record = {
+            'user_id': user_id,
+            'timestamp': session.get('timestamp') or datetime.now().isoformat(),
+            'questions': session.get('questions', []),
+            'answers': session.get('answers', []),
+            'scores': session.get('scores', []),
+            'total_score': session.get('total_score', 0) or 0,
+            'accuracy': session.get('accuracy', 0) or 0,
+            'topic': session.get('topic') or DEFAULT_TOPIC
+        }
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO sessions (user_id, timestamp, questions, answers, scores, total_score, accuracy, topic) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, record['timestamp'], json.dumps(record['questions']), json.dumps(record['answers']),
+                 json.dumps(record['scores']), record['total_score'], record['accuracy'], record['topic'])
+            )
+            self._apply_to_aggregates(conn, record)
+        record['id'] = cursor.lastrowid
+        return record
+
+    def _apply_to_aggregates(self, conn, record):
+        """Fold one session into the totals, daily, topic and histogram rollups"""
+        day = record['timestamp'][:10]
+        score = record['total_score']
+        accuracy = record['accuracy']
+        scores = [s for s in record['scores'] if isinstance(s, (int, float)) and not isinstance(s, bool)]
+        now = datetime.now().isoformat()
+        for user_id in (ALL_USERS, record['user_id']):
+            conn.execute(
+                "INSERT INTO analytics_totals (user_id, sessions, score_sum, accuracy_sum, answers, updated_at) "
+                "VALUES (?, 1, ?, ?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET sessions = sessions + 1, score_sum = score_sum + excluded.score_sum, "
+                "accuracy_sum = accuracy_sum + excluded.accuracy_sum, answers = answers + excluded.answers, "
+                "updated_at = excluded.updated_at",
+                (user_id, score, accuracy, len(scores), now)
+            )
+            conn.execute(
+                "INSERT INTO analytics_daily (user_id, day, sessions, score_sum, accuracy_sum) VALUES (?, ?, 1, ?, ?) "
+                "ON CONFLICT(user_id, day) DO UPDATE SET sessions = sessions + 1, "
+                "score_sum = score_sum + excluded.score_sum, accuracy_sum = accuracy_sum + excluded.accuracy_sum",
+                (user_id, day, score, accuracy)
+            )
+            conn.execute(
+                "INSERT INTO analytics_topics (user_id, topic, sessions, score_sum, accuracy_sum) VALUES (?, ?, 1, ?, ?) "
+                "ON CONFLICT(user_id, topic) DO UPDATE SET sessions = sessions + 1, "
+                "score_sum = score_sum + excluded.score_sum, accuracy_sum = accuracy_sum + excluded.accuracy_sum",
+                (user_id, record['topic'], score, accuracy)
+            )
+            conn.executemany(
+                "INSERT INTO analytics_score_histogram (user_id, score, count) VALUES (?, ?, 1) "
+                "ON CONFLICT(user_id, score) DO UPDATE SET count = count + 1",
+                [(user_id, max(0, min(10, int(round(s))))) for s in scores]
+            )
+
+    def rebuild_analytics(self, conn=None):
+        """Recompute every rollup from the sessions table (one-off, e.g. after upgrading)"""
+        conn = conn or self._connection()
+        for table in ("analytics_totals", "analytics_daily", "analytics_topics", "analytics_score_histogram"):
+            conn.execute(f"DELETE FROM {table}")
+        for row in conn.execute("SELECT * FROM sessions ORDER BY id").fetchall():
+            self._apply_to_aggregates(conn, self._session_from_row(row))
+        conn.commit()
+
+    def list_sessions(self, user_id=None, limit=10, offset=0, since=None, until=None):
+        """Return sessions newest first, optionally for one user and within [since, until)"""
+        clauses = []
+        params = []
+        if user_id is not None:
+            clauses.append("user_id = ?")
+            params.append(user_id)
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            clauses.append("timestamp < ?")
+            params.append(until)
+        where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+        rows = self._connection().execute(
+            f"SELECT * FROM sessions {where} ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?",
+            (*params, limit, offset)
+        ).fetchall()
+        return [self._session_from_row(row) for row in rows]
+
+    @staticmethod
+    def _rollup(row):
+        sessions = row['sessions'] if row else 0
+        return {
+            'total_sessions': sessions,
+            'average_score': row['score_sum'] / sessions if sessions else 0,
+            'average_accuracy': row['accuracy_sum'] / sessions if sessions else 0
+        }
+
+    def analytics_summary(self, user_id=None):
+        """All-time totals, read from the running aggregates in O(1)"""
+        row = self._connection().execute(
+            "SELECT * FROM analytics_totals WHERE user_id = ?", (user_id or ALL_USERS,)
+        ).fetchone()
+        summary = self._rollup(row)
+        summary['total_answers'] = row['answers'] if row else 0
+        return summary
+
+    def analytics_updated_at(self, user_id=None):
+        """When a session last changed this user's analytics (ISO timestamp), or None"""
+        row = self._connection().execute(
+            "SELECT updated_at FROM analytics_totals WHERE user_id = ?", (user_id or ALL_USERS,)
+        ).fetchone()
+        return row['updated_at'] if row else None
+
+    def daily_analytics(self, user_id=None, since=None, until=None):
+        """Per-day rollups within [since, until), oldest first"""
+        clauses = ["user_id = ?"]
+        params = [user_id or ALL_USERS]
+        if since:
+            clauses.append("day >= ?")
+            params.append(since[:10])
+        if until:
+            clauses.append("day < ?")
+            params.append(until[:10])
+        rows = self._connection().execute(
+            f"SELECT * FROM analytics_daily WHERE {' AND '.join(clauses)} ORDER BY day", params
+        ).fetchall()
+        return [{'day': row['day'], **self._rollup(row)} for row in rows]
+
+    def topic_analytics(self, user_id=None, limit=20):
+        rows = self._connection().execute(
+            "SELECT * FROM analytics_topics WHERE user_id = ? ORDER BY sessions DESC LIMIT ?",
+            (user_id or ALL_USERS, limit)
+        ).fetchall()
+        return [{'topic': row['topic'], **self._rollup(row)} for row in rows]
+
+    def score_histogram(self, user_id=None):
+        """Count of graded answers per score 0-10"""
+        histogram = [0] * 11
+        for row in self._connection().execute(
+            "SELECT score, count FROM analytics_score_histogram WHERE user_id = ?", (user_id or ALL_USERS,)
+        ):
+            histogram[row['score']] = row['count']
+        return histogram
+
+    def record_upload(self, user_id, metadata):
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO uploads (user_id, document_id, filename, size, uploaded_at) VALUES (?, ?, ?, ?, ?)",
+                (user_id, metadata['id'], metadata['filename'], metadata['size'], datetime.now().isoformat())
+            )
+        return cursor.lastrowid
+
+    def list_uploads(self, user_id, limit=50, offset=0):
+        rows = self._connection().execute(
+            "SELECT document_id, filename, size, uploaded_at FROM uploads WHERE user_id = ? "
+            "ORDER BY uploaded_at DESC LIMIT ? OFFSET ?",
+            (user_id, limit, offset)
+        ).fetchall()
+        return [{'id': row['document_id'], 'filename': row['filename'], 'size': row['size'],
+                 'uploaded_at': row['uploaded_at']} for row in rows]
+
+    def save_questions(self, pairs, source_key=None):
+        """Store generated (question, answer) pairs; exact duplicates are ignored"""
+        now = datetime.now().isoformat()
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO questions (question_hash, question, answer, source_key, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(question_hash(q), q, a, source_key, now) for q, a in pairs]
+            )
+
+    def get_reference_answer(self, question):
+        """Return the generated answer for a question, if we generated it"""
+        key = question_hash(question)
+        cached = self._answers_cache.get(key)
+        if cached is not None:
+            return cached
+        row = self._connection().execute(
+            "SELECT answer FROM questions WHERE question_hash = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        self._answers_cache.set(key, row['answer'])
+        return row['answer']
+
+
+def build_storage():
+    """Create the storage backend selected by STORAGE_BACKEND (default: sqlite)"""
+    backend = os.getenv("STORAGE_BACKEND", "sqlite").lower()
+    if backend == "sqlite":
+        return SQLiteStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")